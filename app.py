@@ -2,17 +2,19 @@ import fire
 import time
 import logging
 import os
-from scraper.worker import Worker
-from scraper.database import Database
+from scraper.worker import Worker, run_workers, log_fetch_summary
+from scraper.database import get_database
+from scraper.task_claims import publish_tasks, claim_progress
+from scraper.progress_journal import write_manifest, read_manifest, read_journal
 from utils.config import AppConfig
 from utils.helper_functions import set_logger, get_latest_file
-from scraper.base_url_collector import BaseUrlCollector
+from utils.logging_config import stop_logging
 
 
 class ScraperApp:
     def __init__(self):
         self.config = AppConfig()
-        self.postgres_database = Database(self.config)
+        self.postgres_database = get_database(self.config)
     
         # Set the logger
         logger = logging.getLogger(__name__)
@@ -21,13 +23,40 @@ class ScraperApp:
 
     def get_base_urls(self):
         #TODO: perform all the checks here
+        # The collector brings requests and the parsers along, only needed when the suburbs are scraped again
+        from scraper.base_url_collector import BaseUrlCollector
         buc = BaseUrlCollector(self.config, self.logger) 
         self.config.suburb_base_urls = buc.get_suburb_url_reiwa()
 
-    def setup(self):
-        
+    def setup(self, join=None, resume=None):
+        """Get the suburbs, connect and start a batch (or join the distributed batch join, or resume the batch resume)"""
+
+        # A distributed batch keeps its progress in its work table, resuming it is joining it
+        if resume is not None and self.config.distributed:
+            join, resume = resume, None
+
+        manifest = None
+        if resume is not None:
+            self.config.scrape_batch_id = int(resume)
+            manifest = read_manifest(self.config.journal_dir, self.config.scrape_batch_id)
+            if manifest is None:
+                self.logger.warning(f"scrape_batch_id {self.config.scrape_batch_id} has no manifest in "
+                                    f"{self.config.journal_dir}, resuming it with the current suburb list")
+
+        # Joining a batch, the suburbs come from its work table as they are claimed
+        if join is not None:
+            self.config.distributed = True
+            self.config.scrape_batch_id = int(join)
+            self.logger.debug(f"Joining scrape_batch_id {self.config.scrape_batch_id}")
+
+        # Resuming, we carry on with the suburbs of the batch, as the same worker
+        elif manifest is not None:
+            self.config.suburb_base_urls = manifest["suburb_base_urls"]
+            self.config.name = manifest["name"]
+            self.logger.debug(f"Resuming scrape_batch_id {self.config.scrape_batch_id} as {self.config.name}")
+
         # If we are using previously scraped suburb urls 
-        if self.config.use_suburb_cache:
+        elif self.config.use_suburb_cache:
             self.config.suburb_base_urls, latest_file_path = get_latest_file(self.config.suburb_dir)
             self.logger.debug(f"Using the latest suburb list from {latest_file_path}")
 
@@ -41,39 +70,108 @@ class ScraperApp:
             self.get_base_urls()
             self.logger.debug(f"Using the suburb list just scraped!")
         
-        # Connect to the database
-        self.database_conn = self.postgres_database.connect_db()
+        # Connect to the database (a pool of connections, shared by everything that writes to it)
+        self.database_pool = self.postgres_database.connect_db()
+        self.postgres_database.ensure_schema(self.database_pool)
         
-        # Assign the scrape_batch_id
-        self.postgres_database.push_batch_id_to_database(self.database_conn, self.config)
+        if resume is not None:
+            self.skip_finished()
+
+        elif join is None:
+            # Assign the scrape_batch_id
+            self.postgres_database.push_batch_id_to_database(self.database_pool, self.config)
+
+            # What a resumed run needs to carry on
+            write_manifest(self.config)
+
+            # Let the other workers at it
+            if self.config.distributed:
+                published = publish_tasks(self.config, self.database_pool)
+                self.logger.info(f"Published {published} suburbs for scrape_batch_id {self.config.scrape_batch_id}, "
+                                 f"more workers join with: run --join {self.config.scrape_batch_id}")
+
+        # From here on the log goes to the database as we go
+        self.postgres_database.start_log_shipping(self.config, self.database_pool)
 
         # # Write the config file to a binary file
         # self.config.write_config()
 
-        self.worker = Worker(self.logger, self.config, self.database_conn)
+    def skip_finished(self):
+        """Leave out the suburbs of a resumed batch that are done: journaled done, or stored"""
+        statuses = read_journal(self.config.journal_dir, self.config.scrape_batch_id)
+        done = {name for name, status in statuses.items() if status == "done"}
+        done |= self.postgres_database.stored_suburbs(self.database_pool, self.config.scrape_batch_id)
+
+        num_suburbs = len(self.config.suburb_base_urls)
+        self.config.suburb_base_urls = {name: urls for name, urls in self.config.suburb_base_urls.items()
+                                        if name not in done}
+
+        self.logger.info(f"Resuming scrape_batch_id {self.config.scrape_batch_id}: "
+                         f"{num_suburbs - len(self.config.suburb_base_urls)} of {num_suburbs} suburbs done, "
+                         f"{len(self.config.suburb_base_urls)} to go")
+
+    def run(self, workers=1, join=None, resume=None):
+        """Scrape all the suburbs, in this process or sharded over a number of worker processes
 
-    def run(self):
+        With DISTRIBUTED=true the suburbs are published for the batch, and any number of workers (here and in
+        other containers, with --join) claim them until they are all done.
+
+        :param workers: The number of worker processes (--workers N), 1 runs the pipeline right here.
+        :param join: The scrape_batch_id of a distributed batch to work on (--join ID), instead of starting one.
+        :param resume: The scrape_batch_id of a run that didn't finish (--resume ID), to do what it has left.
+        """
         start_time = time.time()
-        self.setup()
+        self.setup(join=join, resume=resume)
 
-        self.worker.run()
-        num_suburbs = len(self.config.suburb_base_urls.keys())
+        if workers > 1:
+            summary = run_workers(self.logger, self.config, workers)
+        else:
+            self.worker = Worker(self.logger, self.config, self.database_pool)
+            self.worker.run()
+            summary = self.worker.summary()
+
+        # Distributed, we only know about the suburbs we ran ourselves
+        if self.config.distributed:
+            num_suburbs = len(summary["done"]) + len(summary["errors"])
+            self.logger.info(f"Batch progress: {claim_progress(self.database_pool, self.config.scrape_batch_id)}")
+        else:
+            num_suburbs = len(self.config.suburb_base_urls.keys())
         time_taken = time.time() - start_time
 
         self.logger.debug(f"Total time takes {time_taken} seconds.")
-        self.logger.info(f"Average time takes {time_taken/num_suburbs} seconds for {num_suburbs} suburbs.")
+        self.logger.info(f"Average time takes {time_taken/max(num_suburbs, 1)} seconds for {num_suburbs} suburbs.")
+
+        # With worker processes, each of them tells its own
+        if workers == 1:
+            log_fetch_summary(self.logger, self.config)
 
-        self.end()
         self.logger.info(f"ScraperApp ends, Congratulations ?!")
+        self.end()
+
+    def progress(self, batch_id):
+        """Show where a distributed batch is at (progress ID)"""
+        database_pool = self.postgres_database.connect_db()
+        try:
+            progress = claim_progress(database_pool, int(batch_id))
+        finally:
+            database_pool.close()
+            stop_logging()
+
+        if progress is None:
+            print(f"Nothing was published for scrape_batch_id {batch_id}")
+        else:
+            for key, value in progress.items():
+                print(f"{key:<15}: {value}")
 
     def end(self):
         """Closing the works"""
-        # Send the log file to the database
-        self.postgres_database.push_log_to_db(config=self.config, database_conn=self.database_conn)
+        # Send the rest of the log file to the database
+        self.postgres_database.push_log_to_db(config=self.config, database_pool=self.database_pool)
 
+        self.database_pool.close()
 
-        # self.database_conn.close()
-        # self.logger.info(f"Database connection closed")
+        # Write out what's still queued up in the log
+        stop_logging()
 
 
 if __name__ == "__main__":
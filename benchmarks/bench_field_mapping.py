@@ -0,0 +1,140 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+"""Micro-benchmark of cleaning and tagging a parsed suburb page: the compiled SUBURB_FIELDS mapping vs the old
+replace() chains and if-chain.
+
+    python benchmarks/bench_field_mapping.py run --number 20000 --repeat 5
+"""
+
+import os
+import sys
+import time
+import logging
+
+import fire
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper.extractors import parse_suburb_details_fast
+from scraper.field_mapping import FieldMapping
+from scraper.stages.suburb_load import SUBURB_FIELDS, SUBURB_SOURCES
+from utils.suburb_task import SuburbTask
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "suburb", "applecross_synthetic.html")
+
+
+class BenchConfig:
+    use_suburb_cache = True
+    scrape_batch_id = 1
+
+
+def clean_key(label):
+    return label.lower().replace(" ", "_").replace("(", "").replace(")", "").replace("\n", "").replace("*", "").replace("-", "")
+
+
+def clean_replace_chains(key_facts, census_summary_2016):
+    """ How the extractors used to clean a page before it was tagged, kept here as the baseline."""
+    key_facts = {label.lower().replace(" ", "_").replace("(", "").replace(")", ""): value.replace("\n", "").replace(",", "")
+                 for label, value in key_facts.items()}
+    census = {}
+    for label, value in census_summary_2016.items():
+        if label == "annual_growth":
+            census[label] = float(value.replace("%", "").replace(",", ""))
+        elif label in ("annual_median_price", "population"):
+            census[label] = int(value.replace("$", "").replace(",", ""))
+        else:
+            census[clean_key(label)] = value.replace("\n", "").replace("$", "").replace(",", "")
+
+    return key_facts, census
+
+
+def tag_if_chain(suburb_task, config, url, page_hash, key_facts, census_summary_2016):
+    """ How SuburbLoadMinion.tag_details used to tag a page (suburb_stats part), kept here as the baseline."""
+    if config.use_suburb_cache:
+        suburb_task.tag_details("suburb_load.suburb_stats.suburb_name", suburb_task.name)
+    if "primary_schools" in key_facts:
+        suburb_task.tag_details("suburb_load.suburb_stats.primary_schools", key_facts['primary_schools'])
+    if "secondary_schools" in key_facts:
+        suburb_task.tag_details("suburb_load.suburb_stats.secondary_schools", key_facts['secondary_schools'])
+    if "shops" in key_facts:
+        suburb_task.tag_details("suburb_load.suburb_stats.shops", key_facts['shops'])
+    if "train_stations" in key_facts:
+        suburb_task.tag_details("suburb_load.suburb_stats.train_stations", key_facts['train_stations'])
+    if "bus_services" in key_facts:
+        suburb_task.tag_details("suburb_load.suburb_stats.bus_services", key_facts['bus_services'])
+    suburb_task.tag_details("suburb_load.suburb_stats.suburb_link", url)
+    if 'median_age_of_residents_years' in census_summary_2016:
+        suburb_task.tag_details("suburb_load.suburb_stats.median_age_of_residents_years", float(census_summary_2016['median_age_of_residents_years']))
+    if 'area_sqkm' in census_summary_2016:
+        suburb_task.tag_details("suburb_load.suburb_stats.area_sqkm", int(census_summary_2016['area_sqkm']))
+    if 'number_of_occupied_dwellings_' in census_summary_2016:
+        suburb_task.tag_details("suburb_load.suburb_stats.number_of_occupied_dwellings_", int(census_summary_2016['number_of_occupied_dwellings_']))
+    if 'annual_growth' in census_summary_2016:
+        suburb_task.tag_details("suburb_load.suburb_stats.annual_growth", float(census_summary_2016['annual_growth']))
+    if 'annual_median_price' in census_summary_2016:
+        suburb_task.tag_details("suburb_load.suburb_stats.annual_median_price", int(census_summary_2016['annual_median_price']))
+    if 'population' in census_summary_2016:
+        suburb_task.tag_details("suburb_load.suburb_stats.population", int(census_summary_2016['population']))
+    if 'average_household_size_persons' in census_summary_2016:
+        suburb_task.tag_details("suburb_load.suburb_stats.average_household_size_persons", float(census_summary_2016['average_household_size_persons']))
+    if 'median_weekly_household_income' in census_summary_2016:
+        suburb_task.tag_details("suburb_load.suburb_stats.median_weekly_household_income", int(census_summary_2016['median_weekly_household_income']))
+    if 'median_monthly_mortgage_repayment' in census_summary_2016:
+        suburb_task.tag_details("suburb_load.suburb_stats.median_monthly_mortgage_repayment", int(census_summary_2016['median_monthly_mortgage_repayment']))
+    if 'population__usually_resident' in census_summary_2016:
+        suburb_task.tag_details("suburb_load.suburb_stats.population__usually_resident", int(census_summary_2016['population__usually_resident']))
+    if 'total_private_dwellings' in census_summary_2016:
+        suburb_task.tag_details("suburb_load.suburb_stats.total_private_dwellings", int(census_summary_2016['total_private_dwellings']))
+    if 'number_of_unoccupied_dwellings' in census_summary_2016:
+        suburb_task.tag_details("suburb_load.suburb_stats.number_of_unoccupied_dwellings", int(census_summary_2016['number_of_unoccupied_dwellings']))
+    suburb_task.tag_details("suburb_load.suburb_stats.suburb_raw_page_hash", page_hash)
+    suburb_task.tag_details("suburb_load.suburb_stats.scrape_batch_id", config.scrape_batch_id)
+
+
+def run(number=20000, repeat=5):
+    """ Check both ways tag the same details, then time them (microseconds per page, the best of repeat runs)."""
+    with open(FIXTURE, encoding="utf-8") as f:
+        key_facts, census_summary_2016 = parse_suburb_details_fast(f.read())
+
+    config = BenchConfig()
+    url, page_hash = "https://reiwa.com.au/suburb/applecross", "0" * 64
+
+    logger = logging.getLogger("bench")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    field_mapping = FieldMapping(SUBURB_FIELDS, config, logger, page_sources=SUBURB_SOURCES)
+
+    def tag_mapping(suburb_task):
+        task_values = {"suburb_name": suburb_task.name, "suburb_link": url,
+                       "suburb_raw_page_hash": page_hash, "scrape_batch_id": config.scrape_batch_id}
+        field_mapping.apply(suburb_task, {"task": task_values, "key_facts": key_facts,
+                                          "census_summary_2016": census_summary_2016})
+
+    def tag_chain(suburb_task):
+        tag_if_chain(suburb_task, config, url, page_hash, *clean_replace_chains(key_facts, census_summary_2016))
+
+    mapped, chained = SuburbTask("applecross"), SuburbTask("applecross")
+    tag_mapping(mapped)
+    tag_chain(chained)
+    if mapped.details != chained.details:
+        raise AssertionError("The field mapping does not tag the same details as the if-chain")
+
+    timings = {}
+    for name, tag in (("if-chain", tag_chain), ("mapping", tag_mapping)):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                tag(SuburbTask("applecross"))
+            elapsed = (time.perf_counter() - start) / number * 1e6
+            best = elapsed if best is None else min(best, elapsed)
+
+        timings[name] = best
+        print(f"{name:<10} {best:8.2f} us/page (best of {repeat})")
+
+    print(f"mapping takes {timings['mapping'] / timings['if-chain']:.0%} of the if-chain's time")
+
+
+if __name__ == "__main__":
+    fire.Fire({"run": run})
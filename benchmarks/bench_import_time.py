@@ -0,0 +1,64 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+"""Import-time report of the app and of each registered stage, from python -X importtime in a fresh interpreter
+per import (so nothing is already loaded): the total, and the heaviest modules it pulls in.
+
+    python benchmarks/bench_import_time.py run --repeat 5 --top 10
+"""
+
+import os
+import sys
+import subprocess
+
+import fire
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from scraper.stages.registry import STAGES
+
+
+def import_times(module):
+    """ {module: (self us, cumulative us)} of importing module, in a fresh interpreter (see -X importtime)."""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr.strip().splitlines()[-1]}")
+
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+
+    return times
+
+
+def report(module, repeat, top):
+    """ Print the best of repeat imports of module, and its top heaviest modules (cumulative) on that run."""
+    best = None
+    for _ in range(repeat):
+        times = import_times(module)
+        if best is None or times[module][1] < best[module][1]:
+            best = times
+
+    print(f"{module:<45} {best[module][1] / 1000:8.1f} ms  ({len(best)} modules)")
+
+    heaviest = sorted(((cumulative, name) for name, (self_us, cumulative) in best.items() if name != module),
+                      reverse=True)
+    for cumulative, name in heaviest[:top]:
+        print(f"    {name:<41} {cumulative / 1000:8.1f} ms")
+
+
+def run(repeat=5, top=8):
+    """ Report the app (what every command pays before doing anything) and each stage (paid once configured)."""
+    modules = ["app"] + sorted({entry.path.split(":")[0] for entry in STAGES.values()})
+    for module in modules:
+        report(module, repeat, top)
+
+
+if __name__ == "__main__":
+    fire.Fire({"run": run})
@@ -0,0 +1,91 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+"""Micro-benchmark of the page extractors (BeautifulSoup vs lxml fast path) over recorded pages.
+
+    python benchmarks/bench_parsers.py run --number 50
+    python benchmarks/bench_parsers.py record suburb https://reiwa.com.au/suburb/applecross
+
+Pages are read from benchmarks/fixtures/suburb (suburb profiles) and benchmarks/fixtures/suburb_list (the
+suburb list). Every page is first checked to give exactly the same result through both extractors.
+"""
+
+import os
+import sys
+import glob
+import time
+from urllib.parse import urlparse
+
+import fire
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper.extractors import SUBURB_DETAILS_PARSERS, SUBURB_LIST_PARSERS
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+PARSERS = {"suburb": SUBURB_DETAILS_PARSERS, "suburb_list": SUBURB_LIST_PARSERS}
+
+
+def load_pages(kind):
+    pages = {}
+    for page_path in sorted(glob.glob(os.path.join(FIXTURE_DIR, kind, "*.html"))):
+        with open(page_path, encoding="utf-8") as f:
+            pages[os.path.basename(page_path)] = f.read()
+    return pages
+
+
+def time_parser(parser, pages, number):
+    """ Best of 3 rounds, in milliseconds per page."""
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(number):
+            for source in pages.values():
+                parser(source)
+        elapsed = (time.perf_counter() - start) / (number * len(pages)) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(number=20):
+    """ Check the extractors agree on every fixture page, then time them."""
+    for kind, parsers in PARSERS.items():
+        pages = load_pages(kind)
+        if not pages:
+            print(f"{kind}: no fixture pages in {os.path.join(FIXTURE_DIR, kind)}")
+            continue
+
+        for name, source in pages.items():
+            if parsers["soup"](source) != parsers["fast"](source):
+                raise AssertionError(f"{kind}/{name}: the fast extractor does not match the soup extractor")
+
+        soup_ms = time_parser(parsers["soup"], pages, number)
+        fast_ms = time_parser(parsers["fast"], pages, number)
+
+        print(f"{kind:<12} pages: {len(pages):<3} soup: {soup_ms:8.2f} ms/page  fast: {fast_ms:8.2f} ms/page  "
+              f"speedup: {soup_ms / fast_ms:5.1f}x")
+
+
+def record(kind, *urls):
+    """ Download pages into the fixtures (kind is suburb or suburb_list)."""
+    import requests
+
+    os.makedirs(os.path.join(FIXTURE_DIR, kind), exist_ok=True)
+
+    for url in urls:
+        name = urlparse(url).path.strip("/").replace("/", "_") or "index"
+        page_path = os.path.join(FIXTURE_DIR, kind, name + ".html")
+
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+
+        with open(page_path, "w", encoding="utf-8") as f:
+            f.write(response.text)
+        print(f"Recorded {url} -> {page_path}")
+
+        time.sleep(3)
+
+
+if __name__ == "__main__":
+    fire.Fire({"run": run, "record": record})
@@ -0,0 +1,124 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+"""Micro-benchmark of turning a task's details into its rows: the RowBuilder vs the DataFrame reshaping
+StoreMinion.publish_results used to do, over synthetic suburb_stats tasks (with a few Json, datetime and numpy
+values).
+
+    python benchmarks/bench_row_builder.py run --tasks 5000
+"""
+
+import os
+import sys
+import time
+import random
+import datetime
+
+import fire
+import numpy as np
+import pandas as pd
+import psycopg2.extras
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper.row_builder import RowBuilder
+from scraper.stages.suburb_load import SUBURB_FIELDS
+from utils.suburb_task import SuburbTask
+
+
+def publish_results_dataframe(task_result):
+    """ How StoreMinion.publish_results used to shape a result before writing it, kept here as the baseline."""
+    json_result = task_result
+
+    stage, table, column, value = [], [], [], []
+    for key in json_result.keys():
+
+        split_key = key.split('.')
+
+        if len(split_key) >= 3:
+            stage.append(split_key[0])
+            table.append(split_key[1])
+            column.append('.'.join(split_key[2:]))
+            value.append(json_result[key])
+
+    results = pd.DataFrame({'stage': stage, 'table': table, 'column': column, 'value': value})
+
+    stage = list(set(stage))
+    result_dict = {}
+
+    for s in stage:
+        result_dict.update({s: {}})
+        stage_results = results[results['stage'] == s]
+        table_list = list(set(stage_results['table']))
+        for t in table_list:
+            table_results = stage_results[stage_results['table'] == t]
+            columns = list(table_results['column'])
+            values = list(table_results['value'])
+            values = [psycopg2.extras.Json(v) if isinstance(v, dict) else v for v in values]
+            values = [str(v) if isinstance(v, datetime.datetime) else v for v in values]
+            values = [float(v) if isinstance(v, np.float32) else v for v in values]
+            columns = [str(c) for c in columns]
+            result_dict[s].update({t: {'columns': columns, 'values': values}})
+
+    return result_dict
+
+
+def synthetic_tasks(count, seed=0):
+    """ Tasks tagged like SuburbLoadMinion does (suburb and suburb_stats), with random values."""
+    rng = random.Random(seed)
+    tasks = []
+    for i in range(count):
+        suburb_task = SuburbTask(f"suburb-{i}")
+        for field in SUBURB_FIELDS:
+            if field.coerce is float:
+                value = np.float32(rng.uniform(0, 100)) if i % 10 == 0 else rng.uniform(0, 100)
+            elif field.coerce is int:
+                value = rng.randint(0, 100000)
+            else:
+                value = f"{field.key}-{i}"
+            suburb_task.tag_details(field.target, value)
+
+        # Some results carry json and timestamps too
+        if i % 4 == 0:
+            suburb_task.tag_details("suburb_load.suburb_stats.extra", {"source": "synthetic", "i": i})
+            suburb_task.tag_details("suburb_load.suburb_stats.scraped_at", datetime.datetime(2021, 1, 1, 0, 0, i % 60))
+        tasks.append(suburb_task)
+
+    return tasks
+
+
+def comparable(result_dict):
+    """ A result with lists for tuples and Json unwrapped, to check both ways give the same."""
+    return {stage: {table: {'columns': list(rows['columns']),
+                            'values': [value.adapted if isinstance(value, psycopg2.extras.Json) else value
+                                       for value in rows['values']]}
+                    for table, rows in tables.items()}
+            for stage, tables in result_dict.items()}
+
+
+def run(tasks=5000, repeat=3):
+    """ Check both ways give the same rows, then time them (microseconds per task, best of repeat)."""
+    suburb_tasks = synthetic_tasks(tasks)
+    row_builder = RowBuilder()
+
+    for suburb_task in suburb_tasks[:100]:
+        if comparable(row_builder.result_dict(suburb_task.details)) != \
+                comparable(publish_results_dataframe(suburb_task.details)):
+            raise AssertionError(f"The row builder does not give the same rows for {suburb_task.name}")
+
+    for name, build in (("dataframe", publish_results_dataframe), ("row-builder", row_builder.result_dict)):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for suburb_task in suburb_tasks:
+                build(suburb_task.details)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        print(f"{name:<12} {best / tasks * 1e6:9.2f} us/task  ({tasks} tasks in {best:.3f} s)")
+
+    print(f"{len(row_builder.layouts)} layouts compiled")
+
+
+if __name__ == "__main__":
+    fire.Fire({"run": run})
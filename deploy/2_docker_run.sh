@@ -1,3 +1,9 @@
 docker run --rm --name z-property-scraper --env-file $(pwd)/utils/args.env -v $(pwd)/deploy/keepitsecret:/app/keepitsecret -v $(pwd)/resources:/app/resources --net=host web_scraping/property_scraper:recent_build
 
+# Distributed (DISTRIBUTED=true in args.env): the container above starts the batch and publishes its suburbs,
+# more containers then work on the same batch with its scrape_batch_id (logged as "more workers join with: ...")
+# docker run --rm --name z-property-scraper-2 --env-file $(pwd)/utils/args.env -v $(pwd)/deploy/keepitsecret:/app/keepitsecret -v $(pwd)/resources:/app/resources --net=host web_scraping/property_scraper:recent_build python3 /app/app.py run --join <scrape_batch_id>
+# Where the batch is at:
+# docker run --rm --env-file $(pwd)/utils/args.env -v $(pwd)/deploy/keepitsecret:/app/keepitsecret --net=host web_scraping/property_scraper:recent_build python3 /app/app.py progress <scrape_batch_id>
+
 # docker run -it --name z-property-scraper --env-file /Users/zubairahmed/PROJECTS/web_scraping/property_scraper/utils/args.env -v /Users/zubairahmed/PROJECTS/web_scraping/property_scraper/keepitsecret:/app/keepitsecret --net=host web_scraping/property_scraper:recent_build bash
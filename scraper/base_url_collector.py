@@ -1,9 +1,9 @@
-from bs4 import BeautifulSoup
-import requests
 import os
 from utils.config import AppConfig
 from utils.helper_functions import dumppickle, create_dir, set_logger
 from utils.helper_functions import create_dir
+from scraper.http_client import get_http_client
+from scraper.extractors import SUBURB_LIST_PARSERS
 import logging
 
 
@@ -25,25 +25,11 @@ class BaseUrlCollector:
         suburb_list_url = os.path.join(self.base_url_reiwa, self.url_tail)
         self.logger.debug(f"Read the suburb_list_url: {suburb_list_url}")
 
-        source = requests.get(suburb_list_url).text
-        soup = BeautifulSoup(source, 'lxml')
+        source = get_http_client(self.config).get_text(suburb_list_url)
         self.config.raw_scrape_suburb_list = source
 
-        table = soup.find("table", class_="data-table members-data-table")
-
-        # Get the header of the table
-        header_row = table.find('tr')
-        ths = []
-        for th in header_row.find_all('th'):
-            ths.append(th.text.lower())
-        
-        suburb_main_dict = {ths[0]: [], ths[1]: [], ths[2]: [], ths[3]: []}
-        for table_row in table.find_all('tr')[1:]:
-            tds = table_row.find_all('td')
-            suburb_main_dict[ths[0]].append(tds[0].text.replace("\n", ""))
-            suburb_main_dict[ths[1]].append(int(tds[1].text.replace("\n", "").replace("$", "").replace(",", "")))
-            suburb_main_dict[ths[2]].append(float(tds[2].text.replace("\n", "").replace("%", "")))
-            suburb_main_dict[ths[3]].append(tds[3].text.replace("\n", ""))
+        suburb_main_dict = SUBURB_LIST_PARSERS[self.config.html_parser](source)
+        ths = list(suburb_main_dict.keys())
             
         # print(f"{len(suburb_main_dict[ths[0]])} suburbs have been listed!")
         
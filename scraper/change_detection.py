@@ -0,0 +1,100 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import json
+import hashlib
+import threading
+
+import psycopg2.extras
+
+
+# Columns that change every batch whatever the suburb does, they are left out of the fingerprint
+EXCLUDED_COLUMNS = ("scrape_batch_id", "suburb_raw_page_hash")
+
+
+def fingerprint(details, excluded_columns=EXCLUDED_COLUMNS):
+    """ A stable hash of a task's tagged details ({stage.table.column: value}), the same values give the same
+    fingerprint from one run to the next.
+
+    :param details: The task's details.
+    :param excluded_columns: Columns (whatever their stage and table) left out.
+    :return: The sha256 hex digest.
+    """
+    kept = {key: value for key, value in details.items() if key.split(".", 2)[-1] not in excluded_columns}
+    payload = json.dumps(kept, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class FingerprintIndex:
+    """ The fingerprint of what was last written for each suburb, and in which batch (suburb_fingerprint).
+
+    It is loaded whole, in one query, when the store stage starts, so checking a task costs a dict lookup.
+    A suburb whose fingerprint hasn't changed gets a marker in suburb_unchanged ("unchanged since batch X")
+    instead of its rows. Fingerprints are recorded once the rows they stand for are written.
+    """
+
+    def __init__(self, database_pool, logger):
+        self.database_pool = database_pool
+        self.logger = logger
+
+        # {suburb_name: (fingerprint, scrape_batch_id it was written in)}
+        self.index = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.database_pool.connection() as database_conn:
+            cursor = database_conn.cursor()
+            try:
+                cursor.execute("SELECT suburb_name, fingerprint, scrape_batch_id FROM suburb_fingerprint;")
+                index = {name: (value, scrape_batch_id) for name, value, scrape_batch_id in cursor.fetchall()}
+
+            finally:
+                cursor.close()
+
+        with self.lock:
+            self.index = index
+
+        self.logger.debug(f"Loaded the fingerprints of {len(index)} suburbs")
+
+    def unchanged_since(self, suburb_name, value):
+        """ The batch the suburb was last written in, if it is unchanged since. None if it has to be written."""
+        with self.lock:
+            last = self.index.get(suburb_name)
+
+        if last is not None and last[0] == value:
+            return last[1]
+
+        return None
+
+    def mark_unchanged(self, markers):
+        """ :param markers: [(scrape_batch_id, suburb_name, since_batch_id)]"""
+        with self.database_pool.connection() as database_conn:
+            cursor = database_conn.cursor()
+            try:
+                psycopg2.extras.execute_values(
+                    cursor,
+                    "INSERT INTO suburb_unchanged(scrape_batch_id, suburb_name, since_batch_id) VALUES %s "
+                    "ON CONFLICT (scrape_batch_id, suburb_name) DO NOTHING;",
+                    markers, page_size=1000)
+
+            finally:
+                cursor.close()
+
+    def record(self, fingerprints):
+        """ :param fingerprints: [(suburb_name, fingerprint, scrape_batch_id)] of rows that were just written."""
+        with self.database_pool.connection() as database_conn:
+            cursor = database_conn.cursor()
+            try:
+                psycopg2.extras.execute_values(
+                    cursor,
+                    "INSERT INTO suburb_fingerprint(suburb_name, fingerprint, scrape_batch_id) VALUES %s "
+                    "ON CONFLICT (suburb_name) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, "
+                    "scrape_batch_id = EXCLUDED.scrape_batch_id, updated_at = now();",
+                    fingerprints, page_size=1000)
+
+            finally:
+                cursor.close()
+
+        with self.lock:
+            for suburb_name, value, scrape_batch_id in fingerprints:
+                self.index[suburb_name] = (value, scrape_batch_id)
@@ -0,0 +1,88 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import json
+import hashlib
+
+import psycopg2.extras
+
+# Settings whose JSON is longer than this are kept as artifacts rather than in the snapshot
+MAX_SETTING_CHARS = 1024
+
+EXISTING_ARTIFACTS_QUERY = "SELECT artifact_hash FROM config_artifact WHERE artifact_hash = ANY(%s);"
+
+INSERT_ARTIFACTS_QUERY = """
+INSERT INTO config_artifact(artifact_hash, name, size_bytes, content) VALUES %s
+ON CONFLICT (artifact_hash) DO NOTHING;
+"""
+
+
+def canonical_json(value):
+    """ The same value always gives the same JSON (and so the same hash)."""
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def is_setting(payload):
+    """ True for what belongs in the snapshot itself: anything short, scalars as well as small (or empty) lists and
+    dicts. Hashing those would cost more than keeping them."""
+    return len(payload) <= MAX_SETTING_CHARS
+
+
+def config_snapshot(config):
+    """ What a batch is run with, small enough to go with every batch row.
+
+    The settings are kept as their JSON (so a datetime is kept as its str, as in an artifact). Anything bigger (the suburb list page, the suburbs and their urls) is an
+    artifact: the snapshot only has its content hash, under "artifact_hashes", and the content goes once into
+    config_artifact (see store_artifacts), however many batches are run with it.
+
+    :param config: The config of the batch.
+    :return: (snapshot, {artifact_hash: (name, JSON content)})
+    """
+    snapshot, artifact_hashes, artifacts = {}, {}, {}
+    for key, value in sorted(vars(config).items()):
+        payload = canonical_json(value)
+        if is_setting(payload):
+            snapshot[key] = json.loads(payload)
+            continue
+
+        artifact_hash = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        artifact_hashes[key] = artifact_hash
+        artifacts.setdefault(artifact_hash, (key, payload))
+
+    snapshot["artifact_hashes"] = artifact_hashes
+    return snapshot, artifacts
+
+
+def store_artifacts(cursor, artifacts):
+    """ Put the artifacts config_artifact doesn't have yet in it (on the cursor's transaction).
+
+    Those it already has aren't sent again, so a batch run with the same suburbs as the last one costs one lookup.
+
+    :param artifacts: {artifact_hash: (name, JSON content)}, as config_snapshot gives them.
+    :return: The number of artifacts that were new.
+    """
+    if not artifacts:
+        return 0
+
+    cursor.execute(EXISTING_ARTIFACTS_QUERY, (list(artifacts),))
+    existing = {found[0] for found in cursor.fetchall()}
+
+    rows = [(artifact_hash, name, len(payload.encode("utf-8")), payload)
+            for artifact_hash, (name, payload) in artifacts.items() if artifact_hash not in existing]
+    if rows:
+        psycopg2.extras.execute_values(cursor, INSERT_ARTIFACTS_QUERY, rows, template="(%s, %s, %s, %s::jsonb)")
+
+    return len(rows)
+
+
+def read_artifact(database_pool, artifact_hash):
+    """ The content of an artifact a batch's snapshot refers to (None if there is no such artifact)."""
+    with database_pool.connection() as database_conn:
+        cursor = database_conn.cursor()
+        try:
+            cursor.execute("SELECT content FROM config_artifact WHERE artifact_hash = %s;", (artifact_hash,))
+            found = cursor.fetchone()
+            return None if found is None else found[0]
+
+        finally:
+            cursor.close()
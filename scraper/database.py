@@ -1,21 +1,290 @@
-from keepitsecret.decrypt_file import decrypt_secrets
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+import io
+import time
 import datetime
 import logging
-from utils.helper_functions import set_logger, get_latest_file
+import weakref
+import threading
+from contextlib import contextmanager
+from utils.helper_functions import set_logger
+from scraper.log_shipper import LogShipper
+from scraper.config_snapshot import config_snapshot, store_artifacts
+
+
+def quote_columns(columns, prefix=""):
+    """The column list of a query, with the columns that have a '.' in them quoted (and prefixed, eg. with "s.")"""
+    return ','.join([prefix + ("\"" + c + "\"" if '.' in c else c) for c in columns])
+
+
+def copy_value(value):
+    """A value as COPY (text format) reads it"""
+    if value is None:
+        return "\\N"
+
+    if isinstance(value, psycopg2.extras.Json):
+        value = value.dumps(value.adapted)
+
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copy_line(row):
+    return "\t".join([copy_value(value) for value in row]) + "\n"
+
+
+def positional(query):
+    """A query with %s placeholders, with $1, $2 ... instead (as PREPARE takes them)"""
+    parts = query.split("%s")
+    return parts[0] + "".join(["$" + str(i + 1) + part for i, part in enumerate(parts[1:])])
+
+
+class StatementCache:
+    """ Statements built once for a shape of result, and reused for every result of that shape.
+
+    Statements are keyed by (kind, stage, ((table, columns), ...), use_suburb_cache): everything that goes into
+    building one. Those that are run one result at a time can also be PREPAREd on a connection (see
+    Database.execute_prepared), each gets a name for that.
+    """
+
+    def __init__(self):
+        # {key: statement}
+        self.statements = {}
+        # {key: name to PREPARE it under}
+        self.names = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        """ The statement for key, built (with build()) the first time it is asked for."""
+        with self.lock:
+            statement = self.statements.get(key)
+            if statement is not None:
+                self.hits += 1
+                return statement
+
+            self.misses += 1
+
+        statement = build()
+        with self.lock:
+            return self.statements.setdefault(key, statement)
+
+    def name(self, key):
+        with self.lock:
+            name = self.names.get(key)
+            if name is None:
+                name = "scraper_statement_" + str(len(self.names) + 1)
+                self.names[key] = name
+            return name
+
+    def summary(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            hit_rate = 100.0 * self.hits / lookups if lookups else 0.0
+            return f"{len(self.statements)} statements, {self.hits} hits and {self.misses} misses ({hit_rate:.1f}% hits), " \
+                   f"{len(self.names)} prepared"
+
+
+class ConnectionPool:
+    """ A thread-safe pool of Postgres connections, shared by everything that talks to the database.
+
+    Threads check a connection out (with pool.connection() as conn) and give it back when done, so no two
+    threads ever use the same connection at once. A thread that already has one checked out gets the same one
+    back. Connections that have been idle for a while are checked before they are handed out, and broken ones
+    are thrown away and replaced, so a dropped connection costs a reconnect instead of the run.
+    """
+
+    def __init__(self, dsn, minconn, maxconn, logger, check_after=30):
+        """
+        :param dsn: The connection string.
+        :param minconn: Connections opened up front (and kept).
+        :param maxconn: The most connections open at once, threads wait for one beyond that.
+        :param logger: Where reconnects are reported.
+        :param check_after: Seconds a connection can be idle before it is checked again.
+        """
+        self.pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, dsn)
+        self.maxconn = maxconn
+        self.logger = logger
+        self.check_after = check_after
+
+        # psycopg2's pool raises when it runs out, so threads queue up here first
+        self.slots = threading.BoundedSemaphore(maxconn)
+
+        # {connection: when it was last given back}
+        self.last_used = {}
+
+        # The connection the current thread has checked out, if any
+        self.local = threading.local()
+
+    @contextmanager
+    def connection(self):
+        """ Check a (working, autocommit) connection out for the current thread."""
+        held = getattr(self.local, "connection", None)
+        if held is not None:
+            yield held
+            return
+
+        self.slots.acquire()
+        database_conn = None
+        try:
+            database_conn = self.checkout()
+            self.local.connection = database_conn
+            yield database_conn
+
+        finally:
+            self.local.connection = None
+            if database_conn is not None:
+                self.give_back(database_conn)
+            self.slots.release()
+
+    def checkout(self):
+        for attempt in range(self.maxconn + 1):
+            database_conn = self.pool.getconn()
+
+            if database_conn.closed == 0:
+                idle = time.time() - self.last_used.get(database_conn, 0)
+                if idle < self.check_after or self.is_healthy(database_conn):
+                    database_conn.autocommit = True
+                    return database_conn
+
+            self.logger.warning(f"Replacing a broken database connection")
+            self.last_used.pop(database_conn, None)
+            self.pool.putconn(database_conn, close=True)
+
+        raise ConnectionError("Could not get a working Postgres connection.")
+
+    def give_back(self, database_conn):
+        if database_conn.closed != 0:
+            # It broke while it was out, the pool opens a new one next time
+            self.last_used.pop(database_conn, None)
+            self.pool.putconn(database_conn, close=True)
+            return
+
+        self.last_used[database_conn] = time.time()
+        self.pool.putconn(database_conn)
+
+    def is_healthy(self, database_conn):
+        try:
+            database_conn.autocommit = True
+            cursor = database_conn.cursor()
+            try:
+                cursor.execute("SELECT 1;")
+                cursor.fetchone()
+            finally:
+                cursor.close()
+            return True
+
+        except psycopg2.Error:
+            return False
+
+    def close(self):
+        self.pool.closeall()
+
 
 class Database:
+    # Tables/columns the scraper needs on top of the base schema, applied (idempotently) by ensure_schema()
+    SCHEMA_QUERIES = [
+        # Raw pages live in the page archive, rows only reference them by content hash
+        "ALTER TABLE suburb_stats ADD COLUMN IF NOT EXISTS suburb_raw_page_hash varchar(64);",
+        # The log of a run, shipped while it runs as numbered gzip chunks (see LogShipper)
+        "CREATE TABLE IF NOT EXISTS scrape_batch_log ("
+        "scrape_batch_id integer NOT NULL REFERENCES scrape_batch_run(scrape_batch_id), "
+        "worker_name varchar(64) NOT NULL, "
+        "chunk_no integer NOT NULL, "
+        "log_chunk bytea NOT NULL, "
+        "shipped_at timestamp NOT NULL DEFAULT now(), "
+        "PRIMARY KEY (scrape_batch_id, worker_name, chunk_no));",
+        # The fingerprint of what was last written per suburb, and the batch it was written in (see FingerprintIndex)
+        "CREATE TABLE IF NOT EXISTS suburb_fingerprint ("
+        "suburb_name text PRIMARY KEY, "
+        "fingerprint varchar(64) NOT NULL, "
+        "scrape_batch_id integer NOT NULL, "
+        "updated_at timestamp NOT NULL DEFAULT now());",
+        # Suburbs a batch didn't write, as they were the same as in the batch since_batch_id
+        "CREATE TABLE IF NOT EXISTS suburb_unchanged ("
+        "scrape_batch_id integer NOT NULL REFERENCES scrape_batch_run(scrape_batch_id), "
+        "suburb_name text NOT NULL, "
+        "since_batch_id integer NOT NULL, "
+        "PRIMARY KEY (scrape_batch_id, suburb_name));",
+        # The suburbs of a distributed batch, claimed by its workers under a lease (see TaskClaims)
+        "CREATE TABLE IF NOT EXISTS scrape_batch_task ("
+        "scrape_batch_id integer NOT NULL REFERENCES scrape_batch_run(scrape_batch_id), "
+        "suburb_name text NOT NULL, "
+        "suburb_urls jsonb NOT NULL, "
+        "status varchar(16) NOT NULL DEFAULT 'todo', "
+        "claimed_by varchar(64), "
+        "lease_until timestamp, "
+        "attempts integer NOT NULL DEFAULT 0, "
+        "error text, "
+        "updated_at timestamp NOT NULL DEFAULT now(), "
+        "PRIMARY KEY (scrape_batch_id, suburb_name));",
+        "CREATE INDEX IF NOT EXISTS scrape_batch_task_status ON scrape_batch_task(scrape_batch_id, status);",
+        # SELECT * FROM scrape_batch_progress WHERE scrape_batch_id = ...; tells where a distributed batch is at
+        "CREATE OR REPLACE VIEW scrape_batch_progress AS SELECT scrape_batch_id, "
+        "count(*) AS tasks, "
+        "count(*) FILTER (WHERE status = 'todo') AS todo, "
+        "count(*) FILTER (WHERE status = 'claimed') AS claimed, "
+        "count(*) FILTER (WHERE status = 'claimed' AND lease_until < now()) AS lease_expired, "
+        "count(*) FILTER (WHERE status = 'done') AS done, "
+        "count(*) FILTER (WHERE status = 'error') AS error, "
+        "count(DISTINCT claimed_by) AS workers, "
+        "max(updated_at) AS last_update "
+        "FROM scrape_batch_task GROUP BY scrape_batch_id;",
+        # The big parts of a batch's config (suburb list page, suburb urls), once per content (see config_snapshot)
+        "CREATE TABLE IF NOT EXISTS config_artifact ("
+        "artifact_hash varchar(64) PRIMARY KEY, "
+        "name text NOT NULL, "
+        "size_bytes integer NOT NULL, "
+        "content jsonb NOT NULL, "
+        "created_at timestamp NOT NULL DEFAULT now());",
+    ]
+
+    # The tables a result can have rows for, in the order they are written (referenced tables first), with the
+    # foreign keys a row takes from another table of the same result when it doesn't have them: {column: (stage, table)}
+    RESULT_TABLES = [
+        ("suburb_load", "suburb", {}),
+        ("suburb_load", "suburb_stats", {"suburb_name": ("suburb_load", "suburb")}),
+    ]
+
     def __init__(self, config):
         self.config = config
         self.stage_list = self.config.stage_list
-        self.final_stage = self.stage_list[-2]
-        
-        self.secret_dict = decrypt_secrets()
+        self.final_stage = self.find_final_stage(self.stage_list)
 
         logger = logging.getLogger(__name__)
         self.logger = set_logger(config=self.config, logger=logger)
 
-    def connect_db(self):
+        # Ships the log to the database during the run (see start_log_shipping)
+        self.log_shipper = None
+
+        # Queries built for a shape of result (tables and columns), they're the same for every result of that shape
+        self.statement_cache = StatementCache()
+
+        # {connection: names of the statements PREPAREd on it}, connections that are closed and gone drop out
+        self.prepared = weakref.WeakKeyDictionary()
+        self.prepared_lock = threading.Lock()
+
+    @staticmethod
+    def find_final_stage(stage_list):
+        """The stage whose results are written: the one right before "store" in STAGE_LIST (None without a store stage)"""
+        if "store" not in stage_list:
+            return None
+
+        position = stage_list.index("store")
+        if position == 0:
+            raise ValueError(f"STAGE_LIST={','.join(stage_list)} has no stage before store, "
+                             f"there are no results to store")
+
+        return stage_list[position - 1]
+
+    @property
+    def secret_dict(self):
+        # Decrypted when first needed, once for the whole process
+        return get_secrets()
+
+    def form_dsn(self):
 
         pg_host = self.secret_dict["PG_HOST"]     
         pg_port = self.secret_dict["PG_PORT"]
@@ -26,13 +295,40 @@ class Database:
         pg_connection_string = "host=" + pg_host + " port=" + pg_port + \
                                 " dbname=" + pg_db + " user=" + pg_user + \
                                 " password=" + pg_pass
-        
-        pg_connection = psycopg2.connect(pg_connection_string)
-        self.logger.debug(f"Successfully connected to {pg_db}")
-        pg_connection.autocommit = True
 
-        self.postgresdb = pg_connection
-        return pg_connection
+        return pg_connection_string
+
+    def pool_size(self):
+        """Connections the run needs at most: one per store writer, one for the log shipper, one for the main thread
+        (and one for claiming tasks, when distributed)"""
+        return self.config.store_writers + 2 + (1 if self.config.distributed else 0)
+
+    def connect_db(self):
+        """Open the pool of connections everything else checks its connection out of"""
+        pool_size = self.pool_size()
+
+        database_pool = ConnectionPool(self.form_dsn(), minconn=1, maxconn=pool_size, logger=self.logger)
+        self.logger.debug(f"Successfully connected to {self.secret_dict['PG_DB']} (pool of up to {pool_size})")
+
+        self.postgresdb = database_pool
+        return database_pool
+
+    def ensure_schema(self, database_pool):
+        """Bring the database up to what this version of the scraper writes"""
+        if database_pool is None:
+            raise ConnectionError("Postgres database is not connected!")
+
+        with database_pool.connection() as database_conn:
+            cursor = database_conn.cursor()
+            try:
+                for query in self.SCHEMA_QUERIES:
+                    cursor.execute(query)
+
+                database_conn.commit()
+                self.logger.debug(f"Schema is up to date")
+
+            finally:
+                cursor.close()
 
     def form_query_section(self, result_dict, stage, table, primary_key,
                             foreign_keys=[], foreign_stages=[],
@@ -72,10 +368,9 @@ class Database:
         return insert, vals
 
 
-    def push_results_to_postgresdb(self, result_dict, database_conn) :
+    def form_results_query(self, result_dict):
     
         query_parts = []
-        values = []
         
         # Not expecting the "suburb" in "suburb_load" having any value in case using self.config.use_suburb_cache
         if "suburb_load" in result_dict and "suburb" in result_dict["suburb_load"] :
@@ -84,7 +379,6 @@ class Database:
                                             returning=True)
             
             query_parts += [sx]
-            values += vx
 
         if "suburb_load" in result_dict and "suburb_stats" in result_dict["suburb_load"]:
             if self.config.use_suburb_cache:
@@ -97,15 +391,26 @@ class Database:
                                             returning=False, segment="last")
         
             query_parts += [sx]
-            values += vx
 
         if self.config.use_suburb_cache:
             query = ",".join(query_parts[0:-1]) + query_parts[-1]
         else:
             query = "WITH " + ",".join(query_parts[0:-1]) + query_parts[-1]
 
+        return query
+
+    def push_results_to_postgresdb(self, result_dict, database_conn) :
+
+        tables = [table for table in ("suburb", "suburb_stats") if table in result_dict.get("suburb_load", {})]
+
+        # The query only depends on the tables and columns of the result, build it once per shape
+        statement_key = ("result", "suburb_load",
+                         tuple((table, tuple(result_dict["suburb_load"][table]['columns'])) for table in tables),
+                         self.config.use_suburb_cache)
+        query = self.statement_cache.get(statement_key, lambda: self.form_results_query(result_dict))
+
         # print(f"Suburb: {values[2]}...... QUERY: {query}")
-        values = tuple(values)
+        values = tuple([value for table in tables for value in result_dict["suburb_load"][table]['values']])
 
         # push to the database
         # self.connect_db()
@@ -117,8 +422,11 @@ class Database:
             try :
                 db = database_conn
                 cursor = db.cursor()
-                cursor.execute(query, values)
-                print(f"XXXXXXXXXXX: Query executed successfully!")
+                if self.config.prepare_statements:
+                    self.execute_prepared(cursor, statement_key, query, values)
+                else:
+                    cursor.execute(query, values)
+                self.logger.debug(f"Query executed successfully for Suburb {values[0]}")
                 # print(f"valuesss: {values}")
                 db.commit()
 
@@ -128,7 +436,6 @@ class Database:
                 error_message = e
 
             finally:
-                print(f"Cursor closing for Suburb {values[0]}")
                 # self.lock.release()
                 cursor.close()
 
@@ -140,6 +447,206 @@ class Database:
         else:
             raise ConnectionError("Postgres Database is not connected.")
 
+    def execute_prepared(self, cursor, statement_key, query, values):
+        """EXECUTE the query, PREPAREd on the cursor's connection the first time it runs there (so it is parsed
+        and planned once per connection, not once per result)"""
+        name = self.statement_cache.name(statement_key)
+
+        with self.prepared_lock:
+            prepared = self.prepared.setdefault(cursor.connection, set())
+
+        if name not in prepared:
+            cursor.execute("PREPARE " + name + " AS " + positional(query))
+            prepared.add(name)
+
+        cursor.execute("EXECUTE " + name + "(" + ",".join(["%s"] * len(values)) + ");", values)
+
+    def form_group_rows(self, result_dicts):
+        """Collect the rows of many results per table and set of columns.
+
+        The rows of a table come after the rows they reference, and foreign keys that form_query_section would
+        subselect (eg. suburb_stats.suburb_name) are taken from the result itself.
+
+        :return: [(stage, table, columns, [(index of the result, row), ...]), ...] in the order they have to be written
+        """
+        groups = []
+
+        for stage, table, foreign_keys in self.RESULT_TABLES:
+            # {columns: [(index, row), ...]}, results that miss some columns go in their own group
+            table_groups = {}
+
+            for index, result_dict in enumerate(result_dicts):
+                if table not in result_dict.get(stage, {}):
+                    continue
+
+                columns = list(result_dict[stage][table]['columns'])
+                values = list(result_dict[stage][table]['values'])
+
+                for foreign_key, (foreign_stage, foreign_table) in foreign_keys.items():
+                    foreign = result_dict.get(foreign_stage, {}).get(foreign_table)
+                    if foreign_key not in columns and foreign is not None and foreign_key in foreign['columns']:
+                        columns.insert(0, foreign_key)
+                        values.insert(0, foreign['values'][foreign['columns'].index(foreign_key)])
+
+                table_groups.setdefault(tuple(columns), []).append((index, tuple(values)))
+
+            for columns, rows in table_groups.items():
+                groups.append((stage, table, columns, rows))
+
+        return groups
+
+    def form_group_statements(self, result_dicts):
+        """Turn many results into one multi-row INSERT per table and set of columns.
+
+        :return: [(query, [row, ...]), ...] in the order they have to run
+        """
+        statements = []
+
+        for stage, table, columns, rows in self.form_group_rows(result_dicts):
+            statement_key = ("group", stage, ((table, columns),), self.config.use_suburb_cache)
+            query = self.statement_cache.get(
+                statement_key, lambda: "INSERT INTO " + table + "(" + quote_columns(columns) + ") VALUES %s;")
+
+            statements.append((query, [row for index, row in rows]))
+
+        return statements
+
+    def push_result_group(self, result_dicts, database_pool):
+        """Write many results in a single transaction.
+
+        If the group fails as a whole, it is rolled back and its results are written one by one (through
+        push_results_to_postgresdb), so only the results that are really wrong fail.
+
+        :return: [(error, published), ...] one per result, in the same order
+        """
+        if database_pool is None:
+            raise ConnectionError("Postgres Database is not connected.")
+
+        statements = self.form_group_statements(result_dicts)
+
+        with database_pool.connection() as database_conn:
+            return self.write_group_statements(statements, result_dicts, database_conn)
+
+    def write_group_statements(self, statements, result_dicts, database_conn):
+        cursor = database_conn.cursor()
+        try:
+            # The connection is in autocommit, so the transaction is ours to open and close
+            cursor.execute("BEGIN;")
+            for query, rows in statements:
+                psycopg2.extras.execute_values(cursor, query, rows, page_size=len(rows))
+            cursor.execute("COMMIT;")
+
+            return [("No error message", True)] * len(result_dicts)
+
+        except Exception as e:
+            self.logger.warning(f"Writing a group of {len(result_dicts)} results failed ({e}), writing them one by one")
+            try:
+                cursor.execute("ROLLBACK;")
+            except Exception:
+                # The connection itself is gone, the writes one by one will report it for each result
+                pass
+
+        finally:
+            cursor.close()
+
+        return [self.push_results_to_postgresdb(result_dict, database_conn) for result_dict in result_dicts]
+
+    def copy_result_group(self, result_dicts, database_pool):
+        """Write many results through COPY, in a single transaction.
+
+        The rows of every table are streamed into a temporary staging table with COPY ... FROM STDIN and merged
+        into the table with one INSERT ... SELECT. Foreign keys are looked up with a join on the referenced table
+        (instead of a subselect per row), rows that reference nothing are not merged and their results fail.
+        If the group fails as a whole, it is rolled back and written through push_result_group.
+
+        :return: [(error, published), ...] one per result, in the same order
+        """
+        if database_pool is None:
+            raise ConnectionError("Postgres Database is not connected.")
+
+        with database_pool.connection() as database_conn:
+            outcomes = self.copy_group(result_dicts, database_conn)
+
+        if outcomes is None:
+            outcomes = self.push_result_group(result_dicts, database_pool)
+
+        return outcomes
+
+    def form_copy_statements(self, table, columns):
+        """The statements that COPY rows of table into its staging table and merge them into the table.
+
+        The staging table is a temporary table of the transaction, shaped like the table as it is now. It is only
+        seen by the connection that made it and dropped at commit (or rollback), so writers never wait on each other
+        for it. A table written with more than one set of columns reuses it, emptied.
+
+        :return: (prepare, copy, merge, key): key is the column the merge returns (None if it returns nothing)
+        """
+        foreign_keys = {table: keys for stage, table, keys in self.RESULT_TABLES}
+        staging = table + "_staging"
+        cols = quote_columns(columns)
+
+        prepare = f"CREATE TEMP TABLE IF NOT EXISTS {staging} ON COMMIT DROP AS SELECT * FROM {table} WITH NO DATA; " \
+                  f"TRUNCATE {staging};"
+        copy = f"COPY {staging}({cols}) FROM STDIN;"
+
+        joins = [(column, foreign_table) for column, (foreign_stage, foreign_table)
+                 in foreign_keys[table].items() if column in columns]
+
+        if not joins:
+            return prepare, copy, f"INSERT INTO {table}({cols}) SELECT {cols} FROM {staging};", None
+
+        # Only the rows whose foreign keys are found make it in, which ones is told by what they return
+        key = joins[0][0]
+        merge = f"INSERT INTO {table}({cols}) SELECT {quote_columns(columns, prefix='s.')}" + \
+                f" FROM {staging} s" + \
+                "".join([f" JOIN {foreign_table} ON {foreign_table}.{column} = s.{column}"
+                         for column, foreign_table in joins]) + \
+                f" RETURNING {key};"
+        return prepare, copy, merge, key
+
+    def copy_group(self, result_dicts, database_conn):
+        """The COPY and merge of copy_result_group, on one connection. None if the group failed (and was rolled back)"""
+        outcomes = [("No error message", True)] * len(result_dicts)
+
+        cursor = database_conn.cursor()
+        try:
+            cursor.execute("BEGIN;")
+
+            for stage, table, columns, rows in self.form_group_rows(result_dicts):
+                statement_key = ("copy", stage, ((table, columns),), self.config.use_suburb_cache)
+                prepare, copy, merge, key = self.statement_cache.get(
+                    statement_key, lambda: self.form_copy_statements(table, columns))
+
+                cursor.execute(prepare)
+                cursor.copy_expert(copy, io.StringIO("".join(copy_line(row) for index, row in rows)))
+                cursor.execute(merge)
+
+                if key is None:
+                    continue
+
+                merged = {found[0] for found in cursor.fetchall()}
+
+                position = columns.index(key)
+                for index, row in rows:
+                    if row[position] not in merged:
+                        outcomes[index] = (f"{table}: {key} {row[position]} not found", False)
+
+            cursor.execute("COMMIT;")
+            return outcomes
+
+        except Exception as e:
+            self.logger.warning(f"Copying a group of {len(result_dicts)} results failed ({e}), inserting them instead")
+            try:
+                cursor.execute("ROLLBACK;")
+            except Exception:
+                # The connection itself is gone, the inserts will report it for each result
+                pass
+
+        finally:
+            cursor.close()
+
+        return None
+
     def form_batch_id_query(self, scrape_batch_id: int=None):
         if scrape_batch_id is None:
             batch_id_query = f"""WITH get_batch_id as (INSERT INTO scrape_batch_run(scrape_batch_run_date, config) VALUES(%s, %s) RETURNING scrape_batch_id) SELECT scrape_batch_id FROM get_batch_id;"""
@@ -149,81 +656,121 @@ class Database:
 
         return batch_id_query
 
-    def push_batch_id_to_database(self, database_conn, config):
+    def push_batch_id_to_database(self, database_pool, config):
+        """Start a batch: its row in scrape_batch_run, with the config snapshot (and its new artifacts).
+
+        Sets config.scrape_batch_ts and config.scrape_batch_id. A run can't go on without a batch, so errors are
+        logged and raised.
+
+        :return: The scrape_batch_id.
+        """
         batch_id_query = self.form_batch_id_query()
 
-        if database_conn is not None:
-            error_found = False
-            error_message = None
+        if database_pool is None:
+            raise ConnectionError("Postgres database is not connected!")
+
+        with database_pool.connection() as db:
+            cursor = db.cursor()
             try:
                 # Assign the values
                 config.scrape_batch_ts = str(datetime.datetime.utcnow())
-                print(f"batch_ts: {config.scrape_batch_ts}")
-                # Convert the config for psycopg2 json object for pushing to database
-                psycopg2_json_config = psycopg2.extras.Json(self.config.__dict__)
-                
+                self.logger.debug(f"batch_ts: {config.scrape_batch_ts}")
+                # The batch row only gets the settings, the big parts go (once) to config_artifact by hash
+                snapshot, artifacts = config_snapshot(config)
+                psycopg2_json_config = psycopg2.extras.Json(snapshot)
+
                 # Gather the values
                 values = (config.scrape_batch_ts, psycopg2_json_config)
-                
-                #Connect to teh database
-                db = database_conn
-                cursor = db.cursor()
+
+                # The artifacts and the batch row go in together
+                cursor.execute("BEGIN;")
+                stored = store_artifacts(cursor, artifacts)
                 cursor.execute(batch_id_query, values)
                 scrape_batch_id = cursor.fetchone()[0]
-                print(f"scrape_batch_id: {scrape_batch_id}")
-                db.commit()
-                
-                # Attach the scrape_batch_id to the config
-                config.scrape_batch_id = scrape_batch_id
-                
+                self.logger.info(f"scrape_batch_id: {scrape_batch_id}")
+                self.logger.debug(f"Config snapshot of {len(snapshot) - 1} settings and {len(artifacts)} "
+                                  f"artifacts ({stored} new)")
+                cursor.execute("COMMIT;")
+
             except Exception as e:
-                print(f"ERROR: {e}")
-                error_found = True
-                error_message = e
+                self.logger.error(f"Could not start a batch: {e}")
+                try:
+                    cursor.execute("ROLLBACK;")
+                except Exception:
+                    # The connection itself is gone, there is nothing to roll back
+                    pass
+                raise
 
             finally:
                 cursor.close()
-                print(f"cursor_closed")
 
-        else:
-            raise ConnectionError("Postgres database is not connected!")
-        
+        # Attach the scrape_batch_id to the config
+        config.scrape_batch_id = scrape_batch_id
         return scrape_batch_id
 
-    def form_query_push_log_file(self, config, log_file):
-        query = f"""UPDATE scrape_batch_run SET log_file={log_file} WHERE scrape_batch_id={config.scrape_batch_id};"""
-        return query
-    
-    def push_log_to_db(self, config, database_conn):
-        """Push the log file to the database"""
-        log_file_read, log_file_path = get_latest_file(config.log_dir)
-        log_file_read = psycopg2.Binary(log_file_read)
-
-        self.logger.debug(f"Reading log file {log_file_path}")
-
-        query = self.form_query_push_log_file(config, log_file_read)
-        print(f'query: {query}')
-
-        if database_conn is not None:
+    def stored_suburbs(self, database_pool, scrape_batch_id):
+        """The suburbs of the batch that have their stats stored already (or were stored as unchanged)"""
+        with database_pool.connection() as database_conn:
+            cursor = database_conn.cursor()
             try:
-                db = database_conn
-                cursor = db.cursor()
-                cursor.execute(query)
-                self.logger.debug(f"Pushed log file for scrape_batch_id {config.scrape_batch_id}!")
-                db.commit()
-                
-            except Exception as e:
-                print(f"ERROR: {e}")
-                error_found = True
-                error_message = e
+                cursor.execute("SELECT suburb_name FROM suburb_stats WHERE scrape_batch_id = %s "
+                               "UNION SELECT suburb_name FROM suburb_unchanged WHERE scrape_batch_id = %s;",
+                               (scrape_batch_id, scrape_batch_id))
+                return {row[0] for row in cursor.fetchall()}
 
             finally:
                 cursor.close()
-                print(f"cursor_closed")
 
-        else:
+    def start_log_shipping(self, config, database_pool):
+        """Ship the log to scrape_batch_log as the run goes (needs the scrape_batch_id)"""
+        self.log_shipper = LogShipper(config, database_pool, self.logger, interval=config.log_upload_seconds,
+                                      chunk_size=int(config.log_chunk_kb * 1024))
+        self.log_shipper.start()
+
+    def push_log_to_db(self, config, database_pool):
+        """Push (the rest of) the log file to the database"""
+        if database_pool is None:
             raise ConnectionError("Postgres database is not connected!")
-       
 
+        if self.log_shipper is None:
+            self.log_shipper = LogShipper(config, database_pool, self.logger)
 
-        
+        try:
+            self.log_shipper.close()
+            self.logger.debug(f"Pushed log file for scrape_batch_id {config.scrape_batch_id} "
+                              f"({self.log_shipper.chunk_no} chunks)")
+
+        except Exception as e:
+            self.logger.error(f"ERROR: {e}")
+
+
+_secrets = None
+_secrets_lock = threading.Lock()
+
+
+def get_secrets():
+    """ The decrypted secrets, read and decrypted once for the whole process (on first use)."""
+    global _secrets
+
+    with _secrets_lock:
+        if _secrets is None:
+            # Decrypting pulls in cryptography, only done once the secrets are asked for
+            from keepitsecret.decrypt_file import decrypt_secrets
+            _secrets = decrypt_secrets()
+
+        return _secrets
+
+
+_database = None
+_database_lock = threading.Lock()
+
+
+def get_database(config):
+    """ The Database shared by the whole process (made on first use)."""
+    global _database
+
+    with _database_lock:
+        if _database is None:
+            _database = Database(config)
+
+        return _database
@@ -0,0 +1,64 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import json
+
+from utils.suburb_task import SuburbTask, TaskSummary, short_error
+
+
+class ErrorSpill:
+    """ The pipeline's error stage, on disk: an append-only log of the tasks in error, one JSON line each.
+
+    It stands in for the error stage's to-do (extend, len and iteration), so errored tasks, with their tracebacks,
+    don't pile up in memory however many there are. Only the count is kept, and the log is read back when asked.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The log, without its extension (.jsonl is added).
+        """
+        self.path = path + ".jsonl"
+        self.file = open(self.path, "a")
+        self.count = 0
+
+    def extend(self, tasks):
+        lines = [json.dumps({"name": suburb_task.name, "urls": suburb_task.urls, "error": suburb_task.error},
+                            default=str)
+                 for suburb_task in tasks]
+        if not lines:
+            return
+
+        self.file.write("\n".join(lines) + "\n")
+        self.file.flush()
+        self.count += len(lines)
+
+    def __len__(self):
+        return self.count
+
+    def entries(self):
+        """ The tasks in error as they were logged: {"name", "urls", "error"}, in the order they came."""
+        if not self.file.closed:
+            self.file.flush()
+
+        with open(self.path) as f:
+            for line in f:
+                yield json.loads(line)
+
+    def __iter__(self):
+        for entry in self.entries():
+            yield TaskSummary(entry["name"], "error", short_error(entry["error"]))
+
+    def targets(self):
+        """ The tasks in error as (bare) tasks, to run again."""
+        targets = []
+        for entry in self.entries():
+            suburb_task = SuburbTask(entry["name"])
+            suburb_task.urls = entry["urls"]
+            suburb_task.error = entry["error"]
+            targets.append(suburb_task)
+
+        return targets
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
@@ -0,0 +1,171 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import logging
+
+from lxml import etree
+from bs4 import BeautifulSoup
+
+# Both extractors of a page must return exactly the same thing. The soup ones are the reference (and the
+# fallback), the fast ones parse with lxml directly and only visit the few elements we need through
+# precompiled XPath, without building a BeautifulSoup tree of the whole page. Labels and values are returned as
+# they are on the page, the schema they are mapped with cleans them (see SUBURB_SOURCES in stages/suburb_load).
+
+logger = logging.getLogger(__name__)
+
+HTML_PARSER = etree.HTMLParser(encoding="utf-8")
+
+
+def has_class(class_name):
+    """ XPath predicate: the class attribute has class_name as one of its classes (bs4's class_='x')."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')"
+
+
+def class_is(class_value):
+    """ XPath predicate: the whole class attribute is class_value (bs4's class_='x y')."""
+    return f"normalize-space(@class)='{class_value}'"
+
+
+# The text of an element, as a plain str (no reference back into the tree)
+TEXT = etree.XPath("string()", smart_strings=False)
+
+STATS_DIV = etree.XPath(f"(//div[{class_is('table-responsive table-responsive-mobile-no-border')}])[1]")
+STATS_TABLES = etree.XPath(f".//table[{class_is('data-table data-table-alt table-hover')}]")
+CENSUS_TABLE = etree.XPath(f"(.//table[{class_is('data-table data-table-alt table-hover')}]"
+                           f"[@title='2016 Census Summary'])[1]")
+PROFILE_STATS = etree.XPath(f"//div[{has_class('suburb-profile-stats-mobile')}]")
+MEMBERS_TABLE = etree.XPath(f"(//table[{class_is('data-table members-data-table')}])[1]")
+
+ROWS = etree.XPath(".//tr")
+CELLS = etree.XPath(".//td")
+HEADERS = etree.XPath(".//th")
+SMALL = etree.XPath("(.//small)[1]")
+STRONG = etree.XPath("(.//strong)[1]")
+
+
+def parse_html(source):
+    return etree.fromstring(source.encode("utf-8"), HTML_PARSER)
+
+
+def first(elements):
+    """ The first element of an XPath result, None if it's empty (bs4's find())."""
+    return elements[0] if elements else None
+
+
+def parse_suburb_details_soup(source):
+    """ Key facts and the 2016 census summary of a suburb page ({label: value} each), through BeautifulSoup."""
+    soup = BeautifulSoup(source, 'lxml')
+
+    tables = soup.find('div', class_= "table-responsive table-responsive-mobile-no-border")
+    tables_for_stats = tables.find_all('table', class_="data-table data-table-alt table-hover")
+    table_key_facts = None
+
+    if len(tables_for_stats) > 0: # and tables_for_stats[0].h3.text.lower().replace(" ", "") == "keyfacts":
+        table_key_facts = tables_for_stats[0]
+
+    table_census_summary_2016 = tables.find('table', class_="data-table data-table-alt table-hover", title="2016 Census Summary")
+
+    key_facts = {}
+    if table_key_facts is not None:
+        for tr in table_key_facts.find_all('tr'):
+            tds = tr.find_all('td')
+            key_facts.update({tds[0].text: tds[1].text})
+
+    census_summary_2016 = {}
+    if table_census_summary_2016 is not None:
+        for tr in table_census_summary_2016.find_all('tr')[1:]:
+            tds = tr.find_all('td')
+            census_summary_2016.update({tds[0].text: tds[1].text})
+
+    for suburb_stat in soup.find_all('div', class_='suburb-profile-stats-mobile'):
+        if suburb_stat.small.text.lower() == "annualgrowth":
+            census_summary_2016.update({'annual_growth': suburb_stat.strong.text})
+        elif suburb_stat.small.text.lower() == "annualmed.price":
+            census_summary_2016.update({'annual_median_price': suburb_stat.strong.text})
+        elif suburb_stat.small.text.lower() == "population":
+            census_summary_2016.update({'population': suburb_stat.strong.text})
+        else:
+            logger.warning(f'Got more suburb_stats than the expected 3')
+
+    return key_facts, census_summary_2016
+
+
+def parse_suburb_details_fast(source):
+    """ Same as parse_suburb_details_soup(), through lxml and precompiled XPath."""
+    root = parse_html(source)
+
+    tables = STATS_DIV(root)[0]
+    table_key_facts = first(STATS_TABLES(tables))
+    table_census_summary_2016 = first(CENSUS_TABLE(tables))
+
+    key_facts = {}
+    if table_key_facts is not None:
+        for tr in ROWS(table_key_facts):
+            tds = CELLS(tr)
+            key_facts[TEXT(tds[0])] = TEXT(tds[1])
+
+    census_summary_2016 = {}
+    if table_census_summary_2016 is not None:
+        for tr in ROWS(table_census_summary_2016)[1:]:
+            tds = CELLS(tr)
+            census_summary_2016[TEXT(tds[0])] = TEXT(tds[1])
+
+    for suburb_stat in PROFILE_STATS(root):
+        label = TEXT(SMALL(suburb_stat)[0]).lower()
+        value = TEXT(STRONG(suburb_stat)[0])
+        if label == "annualgrowth":
+            census_summary_2016['annual_growth'] = value
+        elif label == "annualmed.price":
+            census_summary_2016['annual_median_price'] = value
+        elif label == "population":
+            census_summary_2016['population'] = value
+        else:
+            logger.warning(f'Got more suburb_stats than the expected 3')
+
+    return key_facts, census_summary_2016
+
+
+def parse_suburb_list_soup(source):
+    """ The suburb list page's members table as {header: [column values]}, through BeautifulSoup."""
+    soup = BeautifulSoup(source, 'lxml')
+
+    table = soup.find("table", class_="data-table members-data-table")
+
+    # Get the header of the table
+    header_row = table.find('tr')
+    ths = []
+    for th in header_row.find_all('th'):
+        ths.append(th.text.lower())
+
+    suburb_main_dict = {ths[0]: [], ths[1]: [], ths[2]: [], ths[3]: []}
+    for table_row in table.find_all('tr')[1:]:
+        tds = table_row.find_all('td')
+        suburb_main_dict[ths[0]].append(tds[0].text.replace("\n", ""))
+        suburb_main_dict[ths[1]].append(int(tds[1].text.replace("\n", "").replace("$", "").replace(",", "")))
+        suburb_main_dict[ths[2]].append(float(tds[2].text.replace("\n", "").replace("%", "")))
+        suburb_main_dict[ths[3]].append(tds[3].text.replace("\n", ""))
+
+    return suburb_main_dict
+
+
+def parse_suburb_list_fast(source):
+    """ Same as parse_suburb_list_soup(), through lxml and precompiled XPath."""
+    table = MEMBERS_TABLE(parse_html(source))[0]
+    rows = ROWS(table)
+
+    ths = [TEXT(th).lower() for th in HEADERS(rows[0])]
+
+    suburb_main_dict = {ths[0]: [], ths[1]: [], ths[2]: [], ths[3]: []}
+    names, prices, growths, governments = (suburb_main_dict[th] for th in ths[:4])
+    for table_row in rows[1:]:
+        tds = CELLS(table_row)
+        names.append(TEXT(tds[0]).replace("\n", ""))
+        prices.append(int(TEXT(tds[1]).replace("\n", "").replace("$", "").replace(",", "")))
+        growths.append(float(TEXT(tds[2]).replace("\n", "").replace("%", "")))
+        governments.append(TEXT(tds[3]).replace("\n", ""))
+
+    return suburb_main_dict
+
+
+SUBURB_DETAILS_PARSERS = {"soup": parse_suburb_details_soup, "fast": parse_suburb_details_fast}
+SUBURB_LIST_PARSERS = {"soup": parse_suburb_list_soup, "fast": parse_suburb_list_fast}
@@ -0,0 +1,126 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import threading
+from collections import namedtuple
+
+# One line of a schema: take sources[source][key], drop the strip characters from it, coerce it, and tag it on the
+# task as target (stage.table.column). strip=None drops the source's value_strip (see Source). A field with
+# when=(config attribute, value) is only mapped if the config matches.
+Field = namedtuple("Field", ["source", "key", "target", "coerce", "when", "strip"], defaults=(None, None, None))
+
+# A source that comes from a page, and how its labels and values are cleaned: a label becomes a key lowered, with
+# its spaces as "_" and without the label_strip characters, and the value_strip characters are dropped from values.
+Source = namedtuple("Source", ["name", "label_strip", "value_strip"], defaults=("", ""))
+
+
+# Page labels remembered per source (see FieldMapping.learn), past this many new ones are looked up every time
+# (in case a page has junk labels)
+MAX_LABELS = 1000
+
+
+def label_table(label_strip):
+    """ The translate table turning a lowered page label (eg. "area (sqkm)") into a field key (eg. "area_sqkm")."""
+    return str.maketrans(" ", "_", label_strip)
+
+
+class FieldMapping:
+    """ A schema of Fields compiled (once) into per-source lookup tables, applied to a page in a single pass.
+
+    Page sources are given as they are on the page (labels and values). The same few labels show up on every page,
+    so each source maps its labels, as they are, straight to what is done with their values: (target, strip table,
+    coerce) for the usual label of one field, and a tuple of those for the others. A label is cleaned into a key and
+    looked up in the schema only the first time it is seen (see learn), after that a cell is one dict lookup.
+
+    Keys found in a page source that no field maps are logged (once each), so new fields on the site are
+    noticed instead of silently dropped.
+    """
+
+    def __init__(self, fields, config, logger, page_sources=()):
+        """
+        :param fields: The schema, a list of Fields.
+        :param config: Used to decide the fields with a when condition.
+        :param logger: Where unknown fields are reported.
+        :param page_sources: The Sources that come from a page (cleaned, and checked for unknown fields).
+        """
+        self.logger = logger
+        self.label_tables = {source.name: label_table(source.label_strip) for source in page_sources}
+        value_strips = {source.name: source.value_strip for source in page_sources}
+
+        # {source: {key: [(target, strip table, coerce), ...]}}, keys known to the schema but not mapped with this
+        # config have no targets
+        self.keys = {}
+        for field in fields:
+            targets = self.keys.setdefault(field.source, {}).setdefault(field.key, [])
+            if field.when is None or getattr(config, field.when[0]) == field.when[1]:
+                strip = value_strips.get(field.source, "") if field.strip is None else field.strip
+                targets.append((field.target, str.maketrans("", "", strip) if strip else None, field.coerce))
+
+        # {source: ({label: target}, {label: (target, ...)})}: labels of one target, and of none or several
+        self.labels = {source: ({}, {}) for source in self.keys}
+        self.lookup = [(source, single, several) for source, (single, several) in self.labels.items()]
+
+        # Unknown keys already reported
+        self.reported = set()
+        self.lock = threading.Lock()
+
+    def apply(self, suburb_task, sources):
+        """ Tag every mapped field present in sources on the task.
+
+        :param suburb_task: The task to tag.
+        :param sources: {source name: {label: value}}
+        """
+        details = suburb_task.details
+
+        for source, single, several in self.lookup:
+            get_single = single.get
+            for label, value in sources[source].items():
+                target = get_single(label)
+
+                if target is not None:
+                    name, strip, coerce = target
+                    if strip is not None:
+                        value = value.translate(strip)
+                    details[name] = value if coerce is None else coerce(value)
+                    continue
+
+                targets = several.get(label)
+                if targets is None:
+                    targets = self.learn(suburb_task, source, label, value)
+
+                for name, strip, coerce in targets:
+                    stripped = value if strip is None else value.translate(strip)
+                    details[name] = stripped if coerce is None else coerce(stripped)
+
+    def learn(self, suburb_task, source, label, value):
+        """ The targets of a label not seen before, remembered for the next pages (and reported if it's unknown).
+
+        :return: A tuple of (target, strip table, coerce), empty if the label's key isn't mapped.
+        """
+        table = self.label_tables.get(source)
+        key = label if table is None else label.lower().translate(table)
+
+        targets = self.keys[source].get(key)
+        if targets is None and table is not None:
+            self.report_unknown(suburb_task, source, key, value)
+
+        targets = tuple(targets or ())
+
+        single, several = self.labels[source]
+        if len(single) + len(several) < MAX_LABELS:
+            if len(targets) == 1:
+                single[label] = targets[0]
+            else:
+                several[label] = targets
+
+        return targets
+
+    def report_unknown(self, suburb_task, source, key, value):
+        with self.lock:
+            if (source, key) in self.reported:
+                return
+
+            self.reported.add((source, key))
+
+        self.logger.warning(f"Unknown field {source}.{key} (first seen on {suburb_task.name}: {value!r}), "
+                            f"add it to the schema to keep it")
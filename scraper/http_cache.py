@@ -0,0 +1,189 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import os
+import json
+import gzip
+import time
+import hashlib
+import threading
+
+from utils.helper_functions import create_dir
+
+
+class HttpCache:
+    """ An on-disk cache of GET responses, revalidated with conditional GETs.
+
+    Every url with an ETag or Last-Modified gets a gzipped body file and a small json meta file. The next time
+    the url is fetched its validators are sent along (If-None-Match/If-Modified-Since), and a 304 is answered
+    from disk (which counts as storing it again, the host just told us it's current). Entries older than max_age
+    are dropped, and the least recently used ones go once the cache is over max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes, max_age):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        create_dir(self.cache_dir)
+
+        # hits: answered from disk after a 304, misses: no usable entry on disk, stored: written to disk
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self.bytes_saved = 0
+
+        self.lock = threading.Lock()
+
+        # Start within bounds, and keep a running total from there
+        self.total_bytes = 0
+        self.evict()
+
+    def paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        key_dir = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(key_dir, key + ".json"), os.path.join(key_dir, key + ".gz")
+
+    def lookup(self, url):
+        """ The cached entry (meta dict) for url, or None if there is none (or it's too old)."""
+        entry = self.read_entry(url)
+
+        if entry is None:
+            with self.lock:
+                self.misses += 1
+
+        return entry
+
+    def read_entry(self, url):
+        meta_path, body_path = self.paths(url)
+
+        try:
+            with open(meta_path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if time.time() - entry["stored_at"] > self.max_age or not os.path.exists(body_path):
+            return None
+
+        return entry
+
+    def validators(self, entry):
+        """ The conditional request headers for a cached entry."""
+        headers = {}
+
+        if entry is None:
+            return headers
+
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        return headers
+
+    def load(self, url, entry):
+        """ Read the cached body of url after a 304, and restart its max_age. None if it has gone in the meantime.
+
+        :param entry: The entry lookup gave for url (whose validators the host answered 304 to).
+        """
+        meta_path, body_path = self.paths(url)
+
+        try:
+            with open(body_path, "rb") as f:
+                body = gzip.decompress(f.read()).decode("utf-8")
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        # Mark it as recently used, and as current as of now
+        os.utime(body_path)
+        if entry is not None:
+            self.write_atomic(meta_path, json.dumps(dict(entry, stored_at=time.time())), "w")
+
+        with self.lock:
+            self.hits += 1
+            self.bytes_saved += len(body)
+
+        return body
+
+    def store(self, url, headers, body):
+        """ Keep body for url if the response has something to revalidate with.
+
+        :param headers: The response headers (case-insensitive mapping).
+        :param body: The response text.
+        """
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+
+        if etag is None and last_modified is None:
+            return
+
+        meta_path, body_path = self.paths(url)
+        create_dir(os.path.dirname(meta_path))
+
+        data = gzip.compress(body.encode("utf-8"))
+        entry = {"url": url, "etag": etag, "last_modified": last_modified, "stored_at": time.time()}
+
+        # Write then rename, so a reader never sees half a file
+        self.write_atomic(body_path, data, "wb")
+        self.write_atomic(meta_path, json.dumps(entry), "w")
+
+        with self.lock:
+            self.stored += 1
+            self.total_bytes += len(data)
+            over_limit = self.total_bytes > self.max_bytes
+
+        if over_limit:
+            self.evict()
+
+    def write_atomic(self, path, data, mode):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """ Drop entries older than max_age, then the least recently used ones until under max_bytes."""
+        with self.lock:
+            now = time.time()
+            entries = []
+
+            for root, dirs, files in os.walk(self.cache_dir):
+                for name in files:
+                    if not name.endswith(".gz"):
+                        continue
+
+                    body_path = os.path.join(root, name)
+                    stat = os.stat(body_path)
+
+                    if now - stat.st_mtime > self.max_age:
+                        self.remove(body_path)
+                    else:
+                        entries.append((stat.st_mtime, stat.st_size, body_path))
+
+            total_bytes = sum(size for _, size, _ in entries)
+
+            # Least recently used first
+            for _, size, body_path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                self.remove(body_path)
+                total_bytes -= size
+
+            self.total_bytes = total_bytes
+
+    def remove(self, body_path):
+        for path in (body_path, body_path[:-len(".gz")] + ".json"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        self.evicted += 1
+
+    def summary(self):
+        return (f"hits: {self.hits}, misses: {self.misses}, stored: {self.stored}, evicted: {self.evicted}, "
+                f"saved: {self.bytes_saved / 1e6:.1f} MB, size: {self.total_bytes / 1e6:.1f} MB")
@@ -0,0 +1,204 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import time
+import random
+import asyncio
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from scraper.rate_limiter import get_rate_limiter
+from scraper.http_cache import HttpCache
+
+# Brotli is only understood (by requests/aiohttp) when a brotli package is installed
+try:
+    import brotli
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+# Worth another go: the host is busy or had a hiccup
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# The host asked us to slow down
+BACK_OFF_STATUSES = (429, 503)
+
+
+class HttpClient:
+    """ The http client every stage fetches through.
+
+    One requests session shared by all threads: pooled keep-alive connections, compression, connect/read
+    timeouts, bounded retries with jittered back off, and the shared per-host rate limit before every request.
+    Pages (get_text) are revalidated against the on-disk http cache when config.use_http_cache is on.
+    """
+
+    def __init__(self, config, pool_size=1):
+        self.config = config
+        self.rate_limiter = get_rate_limiter(config)
+
+        self.timeout = (config.http_connect_timeout, config.http_read_timeout)
+        self.retries = config.http_retries
+        self.backoff = config.http_backoff
+
+        self.headers = {"Accept-Encoding": ACCEPT_ENCODING}
+
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+
+        self.cache = None
+        if config.use_http_cache:
+            self.cache = HttpCache(config.http_cache_dir,
+                                   max_bytes=config.http_cache_max_mb * 1e6,
+                                   max_age=config.http_cache_max_age_days * 86400)
+
+        self.pool_size = 0
+        self.lock = threading.Lock()
+        self.ensure_pool_size(pool_size)
+
+    def ensure_pool_size(self, pool_size):
+        """ Make sure the connection pool can keep pool_size connections (per host) alive at once."""
+        with self.lock:
+            if pool_size <= self.pool_size:
+                return
+
+            # Retries are ours (with the rate limit in between), not urllib3's
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+            self.pool_size = pool_size
+
+    def retry_delay(self, attempt):
+        """ Exponential back off with full jitter, so retrying threads don't line up."""
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def get(self, url, headers=None):
+        """ GET url, retrying connection errors, timeouts and RETRY_STATUSES up to self.retries times.
+
+        :param headers: Extra request headers (eg. the cache validators).
+        :return: The requests.Response (raises requests.HTTPError for a final error status).
+        """
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+
+            self.rate_limiter.acquire(url)
+
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if last_attempt:
+                    raise
+                time.sleep(self.retry_delay(attempt))
+                continue
+
+            if response.status_code in BACK_OFF_STATUSES:
+                # The whole host slows down, not just this thread
+                self.rate_limiter.back_off(url, response.headers.get("Retry-After"))
+
+            if response.status_code in RETRY_STATUSES and not last_attempt:
+                time.sleep(self.retry_delay(attempt))
+                continue
+
+            response.raise_for_status()
+            return response
+
+    def get_text(self, url):
+        """ The body of url, from the http cache if the host says it has not changed (304)."""
+        if self.cache is None:
+            return self.get(url).text
+
+        entry = self.cache.lookup(url)
+        response = self.get(url, headers=self.cache.validators(entry))
+
+        if response.status_code == 304:
+            source = self.cache.load(url, entry)
+            if source is not None:
+                return source
+
+            # Evicted under our feet, so get it all again
+            response = self.get(url)
+
+        self.cache.store(url, response.headers, response.text)
+        return response.text
+
+    def async_session(self, concurrency):
+        """ An aiohttp session with the same headers and timeouts. Make it inside the running event loop."""
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers)
+
+    async def get_text_async(self, session, url):
+        """ The asyncio twin of get_text(), same retries, rate limit and http cache.
+
+        The cache is files on disk, so it is read and written on the loop's default executor, not on the loop.
+        """
+        if self.cache is None:
+            return await self.fetch_async(session, url)
+
+        loop = asyncio.get_running_loop()
+        entry = await loop.run_in_executor(None, self.cache.lookup, url)
+
+        status, response_headers, source = await self.fetch_async(
+            session, url, headers=self.cache.validators(entry), full=True)
+
+        if status == 304:
+            cached_source = await loop.run_in_executor(None, self.cache.load, url, entry)
+            if cached_source is not None:
+                return cached_source
+
+            status, response_headers, source = await self.fetch_async(session, url, full=True)
+
+        await loop.run_in_executor(None, self.cache.store, url, response_headers, source)
+        return source
+
+    async def fetch_async(self, session, url, headers=None, full=False):
+        """ GET url (with retries). Returns the text, or (status, headers, text) if full."""
+        import aiohttp
+
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+
+            await self.rate_limiter.acquire_async(url)
+
+            try:
+                async with session.get(url, headers=headers) as response:
+
+                    if response.status in BACK_OFF_STATUSES:
+                        self.rate_limiter.back_off(url, response.headers.get("Retry-After"))
+
+                    if response.status not in RETRY_STATUSES or last_attempt:
+                        response.raise_for_status()
+                        source = await response.text()
+
+                        if full:
+                            return response.status, response.headers, source
+                        return source
+
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if last_attempt:
+                    raise
+
+            await asyncio.sleep(self.retry_delay(attempt))
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client(config, pool_size=1):
+    """ The http client shared by everything fetching in this process (made on first use).
+
+    :param pool_size: The concurrency of the caller, the connection pool grows to fit it.
+    """
+    global _http_client
+
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = HttpClient(config, pool_size=pool_size)
+
+    _http_client.ensure_pool_size(pool_size)
+    return _http_client
@@ -0,0 +1,102 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import gzip
+import atexit
+import threading
+from threading import Thread
+
+import psycopg2
+
+from utils.logging_config import flush_logging
+
+
+class LogShipper(Thread):
+    """ Ships the run's log file to the database while the run goes on.
+
+    Every interval seconds, what was added to the log file since the last time is gzipped and appended to
+    scrape_batch_log (chunk_size bytes at a time at most), under the run's scrape_batch_id and worker name. Chunks
+    are numbered, so the log of a worker is its chunks decompressed and put back together in order. Whatever is left is shipped on close(),
+    which also runs at exit, so a run that dies early still leaves (most of) its log behind.
+    """
+
+    def __init__(self, config, database_pool, logger, interval=60, chunk_size=1024 * 1024):
+        """
+        :param config: Where the log file is (log_path), the run's scrape_batch_id and the worker name.
+        :param database_pool: Where the chunks go.
+        :param logger: Where shipping problems are reported (they get shipped next time around).
+        :param interval: Seconds between two shipments.
+        :param chunk_size: The most log bytes in a chunk.
+        """
+        super().__init__(name="log-shipper", daemon=True)
+
+        self.log_path = config.log_path
+        self.scrape_batch_id = config.scrape_batch_id
+        self.worker_name = config.name
+        self.database_pool = database_pool
+        self.logger = logger
+        self.interval = interval
+        self.chunk_size = chunk_size
+
+        # How far into the log file we have shipped, and the number of the next chunk
+        self.offset = 0
+        self.chunk_no = None
+
+        self.stopping = threading.Event()
+        self.closed = False
+        self.lock = threading.Lock()
+
+        atexit.register(self.close)
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.ship()
+            except Exception as e:
+                self.logger.warning(f"Could not ship the log ({e}), trying again in {self.interval} seconds")
+
+    def ship(self):
+        """ Upload what was added to the log file since the last time."""
+        with self.lock:
+            with open(self.log_path, "rb") as f:
+                f.seek(self.offset)
+
+                while True:
+                    data = f.read(self.chunk_size)
+                    if not data:
+                        break
+
+                    self.upload(gzip.compress(data))
+                    self.offset += len(data)
+
+    def upload(self, chunk):
+        with self.database_pool.connection() as database_conn:
+            cursor = database_conn.cursor()
+            try:
+                # A run that is resumed carries on after the chunks it already has
+                if self.chunk_no is None:
+                    cursor.execute("SELECT COALESCE(MAX(chunk_no) + 1, 0) FROM scrape_batch_log "
+                                   "WHERE scrape_batch_id = %s AND worker_name = %s;",
+                                   (self.scrape_batch_id, self.worker_name))
+                    self.chunk_no = cursor.fetchone()[0]
+
+                cursor.execute("INSERT INTO scrape_batch_log(scrape_batch_id, worker_name, chunk_no, log_chunk) "
+                               "VALUES (%s, %s, %s, %s);",
+                               (self.scrape_batch_id, self.worker_name, self.chunk_no, psycopg2.Binary(chunk)))
+                self.chunk_no += 1
+
+            finally:
+                cursor.close()
+
+    def close(self):
+        """ Stop shipping in the background, and ship everything logged so far."""
+        if self.closed:
+            return
+        self.closed = True
+
+        self.stopping.set()
+        if self.is_alive():
+            self.join(self.interval)
+
+        flush_logging()
+        self.ship()
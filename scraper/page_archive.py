@@ -0,0 +1,106 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import os
+import gzip
+import hashlib
+import threading
+
+from utils.helper_functions import create_dir
+
+# zstd if we have it (smaller and faster), gzip otherwise
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class PageArchive:
+    """ Raw scraped pages, stored once each under the sha256 of their content and compressed.
+
+    suburb_stats rows keep only the hash (suburb_raw_page_hash), so identical pages across batches cost nothing
+    extra and the row itself stays a few hundred bytes.
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        create_dir(self.archive_dir)
+
+        # stored: new pages written, deduplicated: pages we already had
+        self.stored = 0
+        self.deduplicated = 0
+        self.bytes_written = 0
+
+        self.lock = threading.Lock()
+
+    def path(self, digest, extension):
+        return os.path.join(self.archive_dir, digest[:2], digest + extension)
+
+    def put(self, source):
+        """ Archive a page (if we don't have it yet) and return its content hash."""
+        data = source.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+
+        for extension in (".html.zst", ".html.gz"):
+            if os.path.exists(self.path(digest, extension)):
+                with self.lock:
+                    self.deduplicated += 1
+                return digest
+
+        if zstandard is not None:
+            extension = ".html.zst"
+            data = zstandard.ZstdCompressor(level=10).compress(data)
+        else:
+            extension = ".html.gz"
+            data = gzip.compress(data)
+
+        page_path = self.path(digest, extension)
+        create_dir(os.path.dirname(page_path))
+
+        # Write then rename, two minions with the same page just write the same file twice
+        tmp_path = f"{page_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, page_path)
+
+        with self.lock:
+            self.stored += 1
+            self.bytes_written += len(data)
+
+        return digest
+
+    def get(self, digest):
+        """ The page stored under digest, None if we don't have it."""
+        page_path = self.path(digest, ".html.zst")
+        if os.path.exists(page_path):
+            # Archived where zstandard was installed, and read back where it isn't
+            if zstandard is None:
+                raise RuntimeError(f"Archived page {digest} is zstd-compressed; install zstandard to read it")
+
+            with open(page_path, "rb") as f:
+                return zstandard.ZstdDecompressor().decompress(f.read()).decode("utf-8")
+
+        page_path = self.path(digest, ".html.gz")
+        if os.path.exists(page_path):
+            with open(page_path, "rb") as f:
+                return gzip.decompress(f.read()).decode("utf-8")
+
+        return None
+
+    def summary(self):
+        return f"stored: {self.stored}, deduplicated: {self.deduplicated}, written: {self.bytes_written / 1e6:.1f} MB"
+
+
+_page_archive = None
+_page_archive_lock = threading.Lock()
+
+
+def get_page_archive(config):
+    """ The page archive shared by the whole process (made on first use)."""
+    global _page_archive
+
+    with _page_archive_lock:
+        if _page_archive is None:
+            _page_archive = PageArchive(config.raw_page_dir)
+
+        return _page_archive
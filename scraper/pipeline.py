@@ -2,46 +2,63 @@
 #  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
 
 from utils.helper_functions import loadpickle, dumppickle, create_dir
-from scraper.stages.suburb_load import SuburbLoadStage
-from scraper.stages.store import StoreStage
 from scraper.stages.stage import Stage, Minion
-from utils.suburb_task import SuburbTask
+from scraper.stages.registry import make_stage
+from scraper.stages.task_queue import TaskQueue
+from scraper.task_claims import TaskClaims
+from scraper.progress_journal import ProgressJournal
+from scraper.error_spill import ErrorSpill
+from utils.suburb_task import SuburbTask, TaskSummary
+from utils.helper_functions import peak_rss_mb
 
 import os
 import time
+import threading
 
 
 class Pipeline(object):
     """A pipeline runs Tasks through a series of (fixed) stages."""
 
-    def __init__(self, logger, config, database_conn):
+    def __init__(self, logger, config, database_pool):
         """Every time a pipeline is initiated, there are a few items to setup."""
 
         # Keep a copy of the configuration
         self.logger = logger
         self.config = config
-        self.database_conn = database_conn
+        self.database_pool = database_pool
         self.stage_list = self.config.stage_list
        
         self.stages = []
         self.ordered_stages = []
 
-        # A Done stage holds all the completed work from this pipeline
+        # A Done stage holds all the completed work from this pipeline, as summaries (the details are stored by then)
         self.done_stage = Stage("Done")
 
-        # An Error stage holds all the tasks that have error-ed out in any stage.
+        # An Error stage holds all the tasks that have error-ed out in any stage, on disk (see start())
         self.error_stage = Stage("Errors")
 
-        # save the scans as jpgs in a cache
-        if "suburb_load" in self.stage_list :
-            suburb_details_stage = SuburbLoadStage(self.config)
-            self.stages.append(suburb_details_stage)
-            self.ordered_stages.append("suburb_details")
+        # Stages wake the pipeline up through this condition instead of the pipeline spinning on them.
+        self.wakeup = threading.Condition()
+        self.pending_events = 0
 
-        # store the results and scan info in the mldb (new postgres database)
-        if "store" in self.stage_list :
-            store_stage = StoreStage(self.config, self.database_conn)
-            self.stages.append(store_stage)
+        # Distributed runs take their tasks from the batch's work table instead (see start())
+        self.claims = None
+
+        # Finished tasks are journaled as they come out, so a run that dies can be resumed (see start())
+        self.journal = None
+
+        # TODO: Setup config option for logs.
+        self.logs_directory = "logs"
+
+        # The stages of STAGE_LIST, in that order. Each is imported only now, when it is configured (see registry)
+        for stage_name in self.stage_list:
+            stage = make_stage(stage_name, self.config, self.database_pool)
+            if stage is None:
+                self.logger.warning(f"No stage goes by {stage_name!r} (in STAGE_LIST), it is left out")
+                continue
+
+            self.stages.append(stage)
+            self.ordered_stages.append(stage_name)
 
         # ???   
         # publish_stage = PublishStage(self.config, self.database)
@@ -69,6 +86,11 @@ class Pipeline(object):
 
         # Update Grade Testing
         # self.stages = [cache_stage, preprocess_stage, grade_stage]
+
+        # Every stage reports back to us when one of its minions finishes.
+        for stage in self.stages:
+            stage.on_change = self.notify
+
         self.logger.debug(f"Pipeline started with stages: {self.stages}")
     
     def run(self):
@@ -146,7 +168,7 @@ class Pipeline(object):
                         # Report it as {Stage Name: to-do/running/error/done}
                         status.append("[{0:<3}:[{1:<3}/{2:<3}/{3:<3}/{4:<3}]] ".format(this_stage.name,
                                                                              len(this_stage.todo),
-                                                                             len(this_stage.minions),
+                                                                             this_stage.running,
                                                                              len(this_stage.error),
                                                                              len(this_stage.done)))
 
@@ -154,6 +176,13 @@ class Pipeline(object):
                     else:
                         status.append("[{0:<3}:[{1:15}]] ".format(this_stage.name, "INACTIVE"))
 
+                # A distributed batch isn't over until every worker's tasks are
+                if self.claims is not None:
+                    self.claims.want_more()
+                    if self.claims.has_more():
+                        there_is_more_to_do = True
+                    status.append("[Claims:[{0}]] ".format(self.claims.status()))
+
                 # Also report our error and done stages.
                 status.append("[{0}:[{1:<5}]] ".format(self.error_stage.name, len(self.error_stage.todo)))
                 status.append("[{0}:[{1:<5}]] ".format(self.done_stage.name, len(self.done_stage.todo)))
@@ -182,64 +211,90 @@ class Pipeline(object):
                 # Make sure we keep track of the status for the next time around.
                 prev_status_string = status_string
 
+                # Nothing moved this time around, so sleep until a minion finishes (or we hit the deadlock timeout).
+                # If something did move, go around again straight away as the next stage may have work now.
+                if there_is_more_to_do and not print_status:
+                    self.wait_for_change(timeout=max(0.0, 10 - (time.time() - last_active)))
+
         # Do any closeout work
         self.end()
 
-    def transfer_tasks(self, stage, next_stage):
-        """ Transfer tasks from stage to the next_stage.
+    def notify(self):
+        """ Wake the pipeline up. Called from minion threads when they finish their work."""
 
-        :param stage: Tasks from this stage's done list will be moved.
-        :param next_stage: Tasks will be placed into next_stage's to-do list.
-        :return: Nothing is returned.
+        with self.wakeup:
+            self.pending_events += 1
+            self.wakeup.notify_all()
+
+    def wait_for_change(self, timeout):
+        """ Block until a stage notifies us or the timeout (seconds) runs out.
+
+        Events that arrived while the pipeline was busy are counted, so they are not lost.
+
+        :param timeout: Maximum number of seconds to wait.
+        :return: True if woken up by an event, False on timeout.
         """
-        # TODO: Implement Locking? Ideal but may not be needed with this architecture.
-        # Multi-threaded isn't really  in python because of the GIL.
 
-        # Lock Stage.Done
+        with self.wakeup:
+            if self.pending_events == 0:
+                self.wakeup.wait(timeout)
+
+            woken = self.pending_events > 0
+            self.pending_events = 0
 
-        # Get items from stage.done
-        prev_stage_done = stage.done
+        return woken
 
-        # Clear (set a new list)
-        stage.done = []
+    def transfer_tasks(self, stage, next_stage):
+        """ Transfer tasks from stage to the next_stage.
 
-        # Unlock Stage.Done
+        Only as many tasks as next_stage has room for are moved. The rest stay in stage.done, which holds up
+        stage's workers until the next stage catches up (backpressure).
 
-        # Lock NextStage.to_do
+        :param stage: Tasks from this stage's done queue will be moved.
+        :param next_stage: Tasks will be placed into next_stage's to-do queue.
+        :return: Nothing is returned.
+        """
 
-        # Extend the list of work to do in the next stage
-        next_stage.todo.extend(prev_stage_done)
+        # The queues do their own locking, so tasks are handed over one at a time (O(1) each).
+        tasks = stage.done.drain(limit=next_stage.todo.free_slots())
 
-        # Unlock Nextstage.to_do
+        # Through the pipeline, only a summary of the task is kept
+        if next_stage is self.done_stage:
+            self.finished(tasks, "done")
+            tasks = [TaskSummary.of(suburb_task, "done") for suburb_task in tasks]
 
+        next_stage.todo.extend(tasks)
 
     def transfer_errors(self, stage, next_stage):
         """ Transfer errors from a stage to the next_stage.
 
         Next_stage should typically be the pipeline's error_stage.
 
-        :param stage: Tasks from this stage's error list will be moved.
-        :param next_stage: Tasks will be placed into next_stage's to-do list.
+        :param stage: Tasks from this stage's error queue will be moved.
+        :param next_stage: Tasks will be placed into next_stage's to-do queue.
         :return: Nothing is returned.
         """
-        # TODO: Implement Locking?
         # TODO: Implement error reporting.
 
-        # Lock Stage.Error
+        tasks = stage.error.drain()
+        next_stage.todo.extend(tasks)
 
-        # Get items from stage.done
-        prev_stage_error = stage.error
-        # Clear (set a new list)
-        stage.error = []
+        if next_stage is self.error_stage:
+            self.finished(tasks, "error")
 
-        # Unlock Stage.Error
+    def finished(self, tasks, status):
+        """ Tasks that made it through the pipeline ("done") or fell out of it ("error").
 
-        # Lock NextStage.Todo
+        They are journaled, and marked in the batch when distributed.
 
-        # Extend the list of work to do in the next stage
-        next_stage.todo.extend(prev_stage_error)
+        :param tasks: The tasks.
+        :param status: "done" or "error".
+        """
+        if self.journal is not None:
+            self.journal.record(tasks, status)
 
-        # Unlock Nextstage.Error
+        if self.claims is not None:
+            self.claims.finished(tasks, status)
 
     def start(self):
         """ Start the pipeline with some initial steps.
@@ -257,6 +312,24 @@ class Pipeline(object):
         # Get the first stage.
         start_stage = self.stages[0]
 
+        self.journal = ProgressJournal(self.config, self.logger, sync_tasks=self.config.journal_sync_tasks,
+                                       sync_seconds=self.config.journal_sync_seconds)
+
+        # Errors go to disk as they come, rather than staying in memory till the end
+        create_dir(self.logs_directory)
+        self.error_stage.todo = ErrorSpill(os.path.join(self.logs_directory,
+                                                        f"{time.time()}-{self.config.name}-error-spill"))
+
+        # Distributed: the tasks are claimed from the batch as the first stage runs short of them
+        if self.config.distributed:
+            start_stage.todo = TaskQueue()
+            self.claims = TaskClaims(self.config, self.database_pool, self.logger, start_stage.todo, self.notify)
+            self.claims.start()
+
+            self.logger.debug(f"Claiming suburb_targets of scrape_batch_id {self.config.scrape_batch_id} "
+                              f"into {start_stage.name}")
+            return True
+
         # Its targets are the pipeline targets
         # suburb_targets = ["suburb"]
         # Targets may be strings (UUIDs) or scans (Json)
@@ -284,8 +357,9 @@ class Pipeline(object):
         self.logger.debug(f"Loaded: {len(suburb_task_list)}, suburb_targets into  {start_stage.name}")
 
         # TODO: maybe self.to_do ? Depends on multi-processing implementation.
-        # Load the targets into the first stage
-        start_stage.todo = suburb_task_list
+        # Load the targets into the first stage. These are only names and urls, so its to-do is left unbounded.
+        start_stage.todo = TaskQueue()
+        start_stage.todo.extend(suburb_task_list)
 
         return True
 
@@ -299,12 +373,35 @@ class Pipeline(object):
         # Spacer
         print("+++++++++++++ PIPELINE END +++++++++++++++++++++")
 
+        # Mark the last finished tasks in the batch
+        if self.claims is not None:
+            self.claims.stop()
+            self.logger.info(f"Task claims: {self.claims.status()}")
+
+        if self.journal is not None:
+            self.journal.close()
+
+        # Let the stages' workers go, and tell what they did
+        for stage in self.stages:
+            stage.stop()
+
+            summary = stage.summary()
+            if summary is not None:
+                self.logger.info(f"Stage {stage.name} {summary}")
+
         # Dump all errors
         self.dump_errors()
 
         # Show us 10 of the errors that occured:
         self.print_errors(10)
 
+        if isinstance(self.error_stage.todo, ErrorSpill):
+            self.error_stage.todo.close()
+
+        peak = peak_rss_mb()
+        if peak is not None:
+            self.logger.info(f"Peak RSS {peak:.1f} MB")
+
         return
 
     def __str__(self):
@@ -401,8 +498,7 @@ class Pipeline(object):
         time_string_now = str(time.time())
         worker_string = self.config.name
 
-        # TODO: Setup config option for logs.
-        logs_directory = "logs"
+        logs_directory = self.logs_directory
 
         # Make the directory if it doesnt exist.
         create_dir(logs_directory)
@@ -413,11 +509,15 @@ class Pipeline(object):
         log_path = os.path.join(logs_directory, log_filename)
         bin_path = os.path.join(logs_directory, bin_filename)
 
+        # The errors are read back (whole) from where they were spilled
+        errors = self.error_stage.todo
+        targets = errors.targets() if isinstance(errors, ErrorSpill) else list(errors)
+
         # For every target error-ed compile a csv
         with open(log_path + ".csv", 'a') as f:
 
-            for task in self.error_stage.todo:
+            for task in targets:
                 f.write(repr(task.name) + "," + repr(task.error) + "\n")
 
         # Also dump (as a bin) the targets and errors.
-        dumppickle(bin_path, self.error_stage.todo)
+        dumppickle(bin_path, targets)
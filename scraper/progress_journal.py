@@ -0,0 +1,114 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import os
+import glob
+import json
+import time
+import threading
+
+from utils.helper_functions import loadpickle, dumppickle
+
+
+def manifest_path(journal_dir, scrape_batch_id):
+    return os.path.join(journal_dir, f"batch_{scrape_batch_id}-manifest")
+
+
+def write_manifest(config):
+    """ Keep what a resumed run needs to carry on the batch: its suburbs and the worker name (for the log chunks)."""
+    dumppickle(manifest_path(config.journal_dir, config.scrape_batch_id),
+               {"scrape_batch_id": config.scrape_batch_id,
+                "name": config.name,
+                "suburb_base_urls": config.suburb_base_urls})
+
+
+def read_manifest(journal_dir, scrape_batch_id):
+    """ The manifest of the batch (see write_manifest), None if this machine never ran it."""
+    return loadpickle(manifest_path(journal_dir, scrape_batch_id) + ".bin")
+
+
+def read_journal(journal_dir, scrape_batch_id):
+    """ The last status journaled for each suburb of the batch, over the journals of all its workers.
+
+    A line cut short by a crash is skipped, that task is simply done again.
+
+    :return: {suburb_name: "done" or "error"}
+    """
+    statuses = {}
+    for path in sorted(glob.glob(os.path.join(journal_dir, f"batch_{scrape_batch_id}-*.jsonl"))):
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+
+                statuses[entry["name"]] = entry["status"]
+
+    return statuses
+
+
+class ProgressJournal:
+    """ An append-only journal of the tasks a worker finished, one JSON line per task done or in error.
+
+    Every line goes to the OS as soon as it is written (it survives the process dying). It is fsync-ed to disk
+    once sync_tasks lines are waiting or sync_seconds have gone by, so a big run doesn't wait on the disk per task.
+    A run resumed with --resume reads the journals back (read_journal) and skips what was done.
+    """
+
+    def __init__(self, config, logger, sync_tasks=50, sync_seconds=1.0):
+        """
+        :param config: Where the journal goes (journal_dir), the scrape_batch_id and worker name it is kept under.
+        :param logger: Where the journal reports to.
+        :param sync_tasks: Lines written before they are fsync-ed.
+        :param sync_seconds: The longest a written line waits to be fsync-ed (checked as lines come in).
+        """
+        self.path = os.path.join(config.journal_dir, f"batch_{config.scrape_batch_id}-{config.name}.jsonl")
+        self.logger = logger
+        self.sync_tasks = sync_tasks
+        self.sync_seconds = sync_seconds
+
+        self.file = open(self.path, "a")
+        self.unsynced = 0
+        self.last_sync = time.time()
+        self.written = 0
+        self.syncs = 0
+
+        self.lock = threading.Lock()
+
+    def record(self, tasks, status):
+        """ Journal tasks that came out of the pipeline, as "done" or "error"."""
+        if not tasks:
+            return
+
+        lines = []
+        for suburb_task in tasks:
+            error = None if suburb_task.error is None else str(suburb_task.error)
+            lines.append(json.dumps({"name": suburb_task.name, "status": status, "error": error, "at": time.time()}))
+
+        with self.lock:
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+
+            self.unsynced += len(lines)
+            self.written += len(lines)
+
+            if self.unsynced >= self.sync_tasks or time.time() - self.last_sync >= self.sync_seconds:
+                self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.time()
+        self.syncs += 1
+
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+
+            if self.unsynced:
+                self.sync()
+            self.file.close()
+
+        self.logger.debug(f"Journaled {self.written} tasks to {self.path} in {self.syncs} syncs")
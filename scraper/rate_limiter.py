@@ -0,0 +1,237 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import time
+import zlib
+import asyncio
+import threading
+import email.utils
+from urllib.parse import urlparse
+
+
+class TokenBucket:
+    """ A token bucket for one host: rate tokens per second, holding at most burst tokens.
+
+    Callers reserve a token up front and are told how long to wait for it, so the same bucket serves
+    threads (time.sleep) and the event loop (asyncio.sleep). Tokens can go into debt, which queues callers up.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+
+        self.tokens = self.burst
+        self.last = time.monotonic()
+
+        # Nobody gets through before this (monotonic) time, set when the host tells us to back off.
+        self.blocked_until = 0.0
+
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """ Take a token and return the seconds to wait before using it."""
+        with self.lock:
+            now = time.monotonic()
+
+            # Refill for the time that has passed
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+            return max(wait, self.blocked_until - now)
+
+    def remaining_block(self):
+        """ Seconds left on a back off, 0 if there is none."""
+        return max(0.0, self.blocked_until - time.monotonic())
+
+    def back_off(self, seconds):
+        """ Stop the whole host for the next seconds, and don't let the queued callers all rush in after."""
+        with self.lock:
+            now = time.monotonic()
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = min(self.tokens, 0.0)
+
+
+class SharedTokenBucket(TokenBucket):
+    """ A TokenBucket kept in shared memory, so worker processes all take their tokens from the same bucket."""
+
+    def __init__(self, rate, burst, values, slot, lock):
+        """
+        :param values: The shared values of all the buckets (see make_shared_rate_limit), 3 per bucket.
+        :param slot: Which bucket of them this is: its [tokens, last, blocked_until] start at values[3 * slot].
+        :param lock: The (shared) lock of this bucket.
+        """
+        self.rate = float(rate)
+        self.burst = float(burst)
+
+        # The state is already set up (and maybe in use), so only pick it up
+        self.values = values
+        self.offset = 3 * slot
+        self.lock = lock
+
+    @property
+    def tokens(self):
+        return self.values[self.offset]
+
+    @tokens.setter
+    def tokens(self, tokens):
+        self.values[self.offset] = tokens
+
+    @property
+    def last(self):
+        return self.values[self.offset + 1]
+
+    @last.setter
+    def last(self, last):
+        self.values[self.offset + 1] = last
+
+    @property
+    def blocked_until(self):
+        return self.values[self.offset + 2]
+
+    @blocked_until.setter
+    def blocked_until(self, blocked_until):
+        self.values[self.offset + 2] = blocked_until
+
+
+class RateLimiter:
+    """ Process-wide request rate limits, one TokenBucket per host.
+
+    With a shared_state, the buckets are SharedTokenBucket-s instead, shared with the other worker processes of the
+    run, so the limit of each host holds for the run as a whole.
+    """
+
+    def __init__(self, rate, burst, default_back_off=30, shared_state=None):
+        self.rate = rate
+        self.burst = burst
+        self.default_back_off = default_back_off
+
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+        self.shared_state = shared_state
+
+    def bucket(self, url):
+        host = urlparse(url).netloc
+
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = self.make_bucket(host)
+
+            return self.buckets[host]
+
+    def make_bucket(self, host):
+        if self.shared_state is None:
+            return TokenBucket(self.rate, self.burst)
+
+        values, locks, hosts = self.shared_state
+        slot = shared_slot(host, hosts, len(locks))
+        return SharedTokenBucket(self.rate, self.burst, values, slot, locks[slot])
+
+    def acquire(self, url):
+        """ Block (this thread) until a request to url's host is allowed."""
+        bucket = self.bucket(url)
+        wait = bucket.reserve()
+
+        while wait > 0:
+            time.sleep(wait)
+
+            # A back off may have come in while we were waiting. Then sit it out, on the token we already have
+            # (taking another would charge the host twice for this request).
+            wait = bucket.remaining_block()
+
+    async def acquire_async(self, url):
+        """ Same as acquire(), without blocking the event loop."""
+        bucket = self.bucket(url)
+        wait = bucket.reserve()
+
+        while wait > 0:
+            await asyncio.sleep(wait)
+
+            wait = bucket.remaining_block()
+
+    def back_off(self, url, retry_after=None):
+        """ Slow the whole host down after it told us to (429/503), honouring its Retry-After header.
+
+        :param url: A url on the host.
+        :param retry_after: The raw Retry-After header value (seconds or an HTTP date), if any.
+        """
+        self.bucket(url).back_off(self.parse_retry_after(retry_after))
+
+    def parse_retry_after(self, retry_after):
+        if retry_after is None:
+            return self.default_back_off
+
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+
+        try:
+            retry_at = email.utils.parsedate_to_datetime(retry_after)
+            return max(0.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return self.default_back_off
+
+
+# Shared buckets for hosts that weren't known when the run started, a host takes one by the hash of its name
+SPARE_SHARED_BUCKETS = 8
+
+
+def shared_slot(host, hosts, slots):
+    """ The shared bucket of host: its own if it was known up front, else one of the spare ones."""
+    if host in hosts:
+        return hosts.index(host)
+
+    # crc32 rather than hash(), which differs from one process to the next
+    spare = slots - len(hosts)
+    return len(hosts) + zlib.crc32(host.encode("utf-8")) % spare
+
+
+def config_hosts(config):
+    """ The hosts the run will fetch from, as far as the config tells: the base urls and the suburbs' urls."""
+    urls = [config.base_url_reiwa, config.base_url_realestate]
+    for suburb_urls in config.suburb_base_urls.values():
+        urls.extend(suburb_urls.values())
+
+    return sorted({urlparse(url).netloc for url in urls if isinstance(url, str)})
+
+
+def make_shared_rate_limit(context, config):
+    """ The state of the token buckets for worker processes to share (see share_rate_limit), full ones to start with.
+
+    There is a bucket per host of the config (see config_hosts), and a few spare ones for any other host.
+
+    :param context: The multiprocessing context the worker processes are started with.
+    :return: (values, locks, hosts): [tokens, last, blocked_until] of each bucket, their locks, and the known hosts.
+    """
+    hosts = tuple(config_hosts(config))
+    slots = len(hosts) + SPARE_SHARED_BUCKETS
+
+    values = context.Array('d', [float(config.request_burst), time.monotonic(), 0.0] * slots, lock=False)
+    return values, [context.Lock() for _ in range(slots)], hosts
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+_shared_state = None
+
+
+def share_rate_limit(shared_state):
+    """ Have this (worker) process take its tokens from a bucket shared with the others. Call before fetching."""
+    global _shared_state
+    _shared_state = shared_state
+
+
+def get_rate_limiter(config):
+    """ The rate limiter shared by everything fetching in this process (made on first use)."""
+    global _rate_limiter
+
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(rate=config.requests_per_second, burst=config.request_burst,
+                                        shared_state=_shared_state)
+
+        return _rate_limiter
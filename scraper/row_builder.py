@@ -0,0 +1,126 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import sys
+import datetime
+import threading
+
+import psycopg2.extras
+
+
+def as_json(value):
+    return psycopg2.extras.Json(value)
+
+
+# How a value is made ready for psycopg2, by type (None: as it is). Checked in this order for types not in here
+# yet, and then remembered for the type (see adapt)
+TYPE_ADAPTERS = [
+    (dict, as_json),
+    (datetime.datetime, str),
+]
+
+# The same for numpy types, which are only looked at once numpy is imported (by whoever made the value)
+NUMPY_ADAPTERS = [
+    ("float32", float),
+]
+
+_type_adapters = {str: None, int: None, float: None, bool: None, type(None): None}
+_type_adapters_lock = threading.Lock()
+
+
+def adapter_for(value_type):
+    for adapted_type, adapter in TYPE_ADAPTERS:
+        if issubclass(value_type, adapted_type):
+            return adapter
+
+    # Without numpy imported there can't be a numpy value, and we don't import it to find that out
+    np = sys.modules.get("numpy")
+    if np is not None:
+        for type_name, adapter in NUMPY_ADAPTERS:
+            if issubclass(value_type, getattr(np, type_name)):
+                return adapter
+
+    return None
+
+
+def adapt(value):
+    """ A value as psycopg2 takes it: dicts as Json, datetimes as strings and numpy float32s as floats."""
+    value_type = type(value)
+    try:
+        adapter = _type_adapters[value_type]
+    except KeyError:
+        adapter = adapter_for(value_type)
+        with _type_adapters_lock:
+            _type_adapters[value_type] = adapter
+
+    return value if adapter is None else adapter(value)
+
+
+class RowLayout:
+    """ Where each value of a task's details goes, for one set of detail keys.
+
+    "stage.table.column" keys are split once, here, into the tables (in the order they first come up) with their
+    columns and the positions of their values in the details. Keys that aren't stage.table.column are left out.
+    """
+
+    def __init__(self, keys, column_adapters):
+        """
+        :param keys: The detail keys, in the order they were tagged.
+        :param column_adapters: {column: adapter} for columns that need their own, the others go through adapt.
+        """
+        tables = {}
+        for position, key in enumerate(keys):
+            split_key = key.split('.')
+            if len(split_key) < 3:
+                continue
+
+            column = '.'.join(split_key[2:])
+            tables.setdefault((split_key[0], split_key[1]), []).append((position, column))
+
+        # [(stage, table, columns, [(position, adapter), ...])]
+        self.tables = [(stage, table,
+                        tuple(column for position, column in slots),
+                        [(position, column_adapters.get(column, adapt)) for position, column in slots])
+                       for (stage, table), slots in tables.items()]
+
+    def build(self, details):
+        values = tuple(details.values())
+
+        result_dict = {}
+        for stage, table, columns, slots in self.tables:
+            row = tuple([adapter(values[position]) for position, adapter in slots])
+            result_dict.setdefault(stage, {})[table] = {'columns': columns, 'values': row}
+
+        return result_dict
+
+
+class RowBuilder:
+    """ Turns a task's details into its rows: {stage: {table: {'columns': (...), 'values': (...)}}}.
+
+    The layout is compiled once per distinct set of detail keys (tasks tagged by the same schema share one), so
+    a task is one pass over its values. The columns tuples are shared between tasks, they are not to be changed.
+    """
+
+    def __init__(self, column_adapters=None):
+        """
+        :param column_adapters: {column: adapter}, for columns whose values need something else than adapt().
+        """
+        self.column_adapters = column_adapters or {}
+
+        # {detail keys: RowLayout}
+        self.layouts = {}
+        self.lock = threading.Lock()
+
+    def layout(self, details):
+        keys = tuple(details)
+
+        layout = self.layouts.get(keys)
+        if layout is None:
+            layout = RowLayout(keys, self.column_adapters)
+            with self.lock:
+                self.layouts[keys] = layout
+
+        return layout
+
+    def result_dict(self, details):
+        return self.layout(details).build(details)
@@ -0,0 +1,56 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import importlib
+from collections import namedtuple
+
+# Where the class of a stage is ("module:Class"), and whether it is made with the database pool as well as the config
+StageEntry = namedtuple("StageEntry", ["path", "needs_database"])
+
+# {(name in STAGE_LIST, mode): StageEntry}. The mode is the stage's <name>_mode config value, for stages that come
+# in more than one class (None: whatever the mode). Modules are only imported once a configured stage needs them,
+# so a pipeline doesn't pay for the parsers and drivers of stages it doesn't run.
+STAGES = {}
+
+
+def register_stage(name, path, needs_database=False, mode=None):
+    """ Make a stage available to STAGE_LIST.
+
+    :param name: The name it goes by in STAGE_LIST.
+    :param path: Where its class is, as "module:Class" (imported when the stage is made).
+    :param needs_database: True if it is made with (config, database_pool), rather than (config).
+    :param mode: The <name>_mode config value this class is for, None for any.
+    """
+    STAGES[(name, mode)] = StageEntry(path, needs_database)
+
+
+register_stage("suburb_load", "scraper.stages.suburb_load:SuburbLoadStage")
+# Only needs aiohttp if asked for
+register_stage("suburb_load", "scraper.stages.suburb_load_async:SuburbLoadAsyncStage", mode="async")
+register_stage("store", "scraper.stages.store:StoreStage", needs_database=True)
+
+
+def stage_entry(name, config):
+    """ The entry of the stage name for the config's mode of it (see STAGES), None if there is no such stage."""
+    mode = getattr(config, f"{name}_mode", None)
+    return STAGES.get((name, mode), STAGES.get((name, None)))
+
+
+def stage_class(entry):
+    module_name, class_name = entry.path.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def make_stage(name, config, database_pool):
+    """ A stage of STAGE_LIST, made for the config.
+
+    :return: The stage, None if no stage goes by that name.
+    """
+    entry = stage_entry(name, config)
+    if entry is None:
+        return None
+
+    cls = stage_class(entry)
+    if entry.needs_database:
+        return cls(config, database_pool)
+    return cls(config)
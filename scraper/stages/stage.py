@@ -5,13 +5,19 @@ import sys
 import traceback
 import time
 import random
+import queue
+import threading
 from threading import Thread
 import logging
 from utils.helper_functions import set_logger
+from scraper.stages.task_queue import TaskQueue
 
 
 class Minion(Thread):
-    """ A minion is a thread that does some work() and holds results."""
+    """ A minion does some work() on a task and holds results.
+
+    It is still a Thread (and can be start()-ed on its own), but stages run it on one of their pooled workers.
+    """
 
     def __init__(self, group=None, target=None, name=None, args=(), kwargs=None, *, daemon=None):
         """Every time a minion is born, there are a few items to setup."""
@@ -55,9 +61,9 @@ class Minion(Thread):
 
         except Exception as error:
 
-            # Exception information is compiled into a traceback string representation.
+            # Exception information is compiled into the traceback, as a string.
             exc_type, exc_value, exc_traceback = sys.exc_info()
-            error_string = repr(traceback.format_exception(exc_type, exc_value, exc_traceback))
+            error_string = "".join(traceback.format_exception(exc_type, exc_value, exc_traceback))
 
             # print("(Handled) Error:", error_string)
 
@@ -114,53 +120,91 @@ class Minion(Thread):
             return True
 
 
+class StageWorker(Thread):
+    """ A long-lived thread of a stage's worker pool.
+
+    It keeps taking tasks from the stage's to-do, runs each one through a minion (in this thread, so no new
+    thread per task) and reports the finished minion through the stage's results queue.
+    """
+
+    def __init__(self, stage, name):
+        super().__init__(name=name, daemon=True)
+
+        self.stage = stage
+
+    def run(self):
+        stage = self.stage
+
+        while not stage.stopping.is_set():
+
+            # Wait a little for a task, then check if we have been told to stop.
+            # Taken out, it is still counted by to-do as in hand, till the stage handles its minion.
+            try:
+                suburb_task = stage.todo.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            # Create our minion to do our task, and run its work right here.
+            minion = stage.make_minion(suburb_task)
+            minion.run()
+
+            # Report back. This blocks if the stage is backed up (backpressure).
+            stage.results.put(minion)
+            stage.notify()
+
+
 class Stage(object):
-    """ Stage takes a list of tasks from to-do and moves them to errored or done.
+    """ Stage takes tasks from to-do and moves them to errored or done.
 
-    To do this: a stage births minions to process a task and cleans up dead minions once done, failed or error-ed.
-    Each minion is its own thread and are limited in the stage by batch_size.
+    To do this: a stage keeps a pool of batch_size long-lived workers (threads). Each worker takes a task from
+    to-do, has a minion do the work and reports the finished minion back, where the stage moves the task to
+    done or error.
     If you are implementing your own stage:
     1. (Compulsory) Override make_minion() to make your stage run your minion type.
     2. (Optional) Override handle_failed if you want task that have success = False do to something else. eg. retry
-    3. (Optional) Override start() and end() if you want to do something custom before launching minions.
+    3. (Optional) Override start() and end() if you want to do something custom before handling minions.
     4. (Alternatively) Override run() if you don't want to use minions or want to use them differently.
     """
 
-    def __init__(self, name):
-        """Every time we create a stage, we need to set up some stuff."""
+    def __init__(self, name, queue_size=0):
+        """Every time we create a stage, we need to set up some stuff.
+
+        :param name: The name of the stage (for logging and debugging).
+        :param queue_size: The most tasks allowed to queue up in to-do, results and done. 0 means unbounded.
+        """
 
         # Every stage has a name (for logging and debugging)
         self.name = name
 
-        # TODO: Implement locking?
-        # self.todolock = threading.Lock()
+        # There are (thread-safe) queues for the Tasks to-do, done and in error.
+        # To-do and done are bounded so a fast stage can't pile up work in front of a slow one.
+        self.todo = TaskQueue(queue_size)
+        self.done = TaskQueue(queue_size)
+        self.error = TaskQueue()
 
-        # There are empty lists for the Tasks to-do, done and in error.
-        self.todo = []
-        # print(f"self.todo: {self.todo}")
-        # print(f"self.todo: {self.todo[0].__dict__}")
-        self.done = []
-        self.error = []
+        # Workers report finished minions here, for the stage to handle.
+        self.results = TaskQueue(queue_size)
 
-        # We keep track of the minions born to this stage.
-        self.minions = []
+        # We keep track of our workers. What they have in hand (running or not yet handled) is counted by to-do
+        # itself: a task taken out of it stays unfinished there until handle_minions() calls task_done().
+        self.workers = []
+        self.stopping = threading.Event()
 
-        # We try to manage only 5 minions per stage, by default, but this can be
+        # We try to manage only 5 workers per stage, by default, but this can be
         # overridden.
         self.batch_size = 5
 
         # Logs generated from here are tagged with the stage name.
         self.logger_minion = logging.getLogger(self.name)
 
-    def is_active(self):
-        """ Checks if this stage is active (minions active or items in to-do."""
+        # The pipeline hooks in here to be woken up whenever a minion of this stage finishes.
+        self.on_change = None
 
-        # If there are any minions active, the stage is active.
-        if len(self.minions) > 0:
-            return True
+    def is_active(self):
+        """ Checks if this stage is active (tasks in hand or items in to-do."""
 
-        # If there are any items in the to-do list, the stage is active.
-        if len(self.todo) > 0:
+        # If there are any items in the to-do list, or taken from it and in hand, the stage is active.
+        if self.todo.unfinished() > 0:
             return True
 
         if len(self.done) > 0:
@@ -172,32 +216,33 @@ class Stage(object):
     def handle_minions(self):
         """ Handle minions that have finished."""
 
-        # Cleanup dead minions
-        for minion in self.minions:
-
-            if minion.done:
+        # Only take as many finished minions as [done] has room for; the rest wait (and so do the workers).
+        for minion in self.results.drain(limit=self.done.free_slots()):
 
-                if minion.success:
+            if minion.success:
 
-                    # If the task is done and a success, move it to [done].
-                    self.done.append(minion.suburb_task)
+                # If the task is done and a success, move it to [done].
+                self.done.put(minion.suburb_task)
 
-                else:
+            else:
 
-                    if minion.errored:
+                if minion.errored:
 
-                        # If the task is done but errored, move it to [errored].
-                        self.error.append(minion.suburb_task)
+                    # If the task is done but errored, move it to [errored].
+                    self.error.put(minion.suburb_task)
 
-                    else:
-                        # Not an error. But not a success. Use the handle_failed method.
-                        self.handle_failed(minion.suburb_task)
+                else:
+                    # Not an error. But not a success. Use the handle_failed method.
+                    self.handle_failed(minion.suburb_task)
 
-                # Now we've handled our dead minon.
-                minion.handled = True
+            # Now we've handled our dead minon, it is out of our hands (it was put somewhere first).
+            minion.handled = True
+            self.todo.task_done()
 
-        # Unhandled minions remain (dead are garbage collected)
-        self.minions = [minion for minion in self.minions if not minion.handled]
+    @property
+    def running(self):
+        """ How many tasks are in hand: taken from to-do, running or waiting to be handled."""
+        return self.todo.in_hand()
 
     def run(self):
         """ General work done by a minion moving stage.
@@ -208,35 +253,14 @@ class Stage(object):
         # Run some methods to setup this stage (before moving minons around).
         self.start()
 
-        # ################### Threaded Implementation ################################
-        # Minions are cleaned up and created up to a batch_size maximum.
+        # ################### Worker Pool Implementation ################################
+        # The workers pull from to-do themselves, we only need to start them once and handle what they finish.
+        if not self.workers:
+            self.start_workers()
 
         # Handle minions
         self.handle_minions()
 
-        # How many more minions can we have
-        slots_available = self.batch_size - len(self.minions)
-
-        # How many more items are there to-do, vs minions we're allowed
-        attempt = min(len(self.todo), slots_available)
-
-        # Start an attempt
-        for i in range(attempt):
-
-            # Lock
-            suburb_task = self.todo.pop(0)
-            # Unlock
-
-            # Threaded
-            # Create our minion to do our task
-            minion = self.make_minion(suburb_task)
-
-            # Add it to our list to keep track of them.
-            self.minions.append(minion)
-
-            # Tell it to run
-            minion.start()
-
         # ############### Non Threaded Implementation ################################
         # Alternatively, we could do steps sequentially here (without minions)
 
@@ -246,12 +270,43 @@ class Stage(object):
         # except:
         #     success = False
         # if success:
-        #     self.done.append(item)
+        #     self.done.put(item)
         # else:
-        #     self.error.append(item)
+        #     self.error.put(item)
 
         self.end()
 
+    def start_workers(self):
+        """ Start the pool of batch_size workers. """
+
+        for i in range(self.batch_size):
+            worker = StageWorker(self, name=f"{self.name}-{i}")
+            self.workers.append(worker)
+            worker.start()
+
+    def stop(self, timeout=5):
+        """ Tell the workers to stop and wait (a bit) for them.
+
+        :param timeout: Seconds to wait for each worker.
+        """
+
+        self.stopping.set()
+
+        for worker in self.workers:
+            worker.join(timeout)
+
+        self.workers = []
+
+    def summary(self):
+        """ A line about what this stage did, for the end of the run. None if there's nothing to tell."""
+        return None
+
+    def notify(self):
+        """ Tell whoever is watching this stage (the pipeline) that something changed. """
+
+        if self.on_change is not None:
+            self.on_change()
+
     def start(self):
         """ Setup the stage run. """
 
@@ -267,14 +322,14 @@ class Stage(object):
     def handle_failed(self, task):
         """ Handles failed tasks.
 
-        Override this method if you need to do more than dump failed items into the error list. (Default behaviour)
+        Override this method if you need to do more than dump failed items into the error queue. (Default behaviour)
         This could be the place to implement a retry or some error correcting process if required.
 
         :param task: The task that failed.
         :return: Nothing.
         """
 
-        self.error.append(task)
+        self.error.put(task)
 
     def make_minion(self, item):
         """ Creates a minion for this stage. Override this to launch your specific stage-minion."""
@@ -1,99 +1,261 @@
+import time
+import zlib
+import queue
+import threading
+from threading import Thread
+
 from scraper.stages.stage import Stage, Minion
-from scraper.database import Database
-import psycopg2
-from psycopg2 import extras
-import pandas as pd
-import datetime
-import numpy as np
+from scraper.stages.task_queue import TaskQueue
+from scraper.database import get_database
+from scraper.change_detection import fingerprint, FingerprintIndex
+from scraper.row_builder import RowBuilder
 from utils.helper_functions import set_logger
 
 
 class StoreMinion(Minion):
+    """ Turns a task's details into the rows to store (result_dict). The StoreStage writes them, in groups."""
+
     def __init__(self, group=None, target=None, name=None, args=(), kwargs=None, *, daemon=None):
         # Mostly, just do what the parent used to do.
         super().__init__(group=group, target=target, name=name, daemon=daemon, args=args, kwargs=kwargs)
 
         self.suburb_task = args[0]
         self.config = args[1]
-        self.database_conn = args[2]
-        self.logger = args[3]
-        
-        self.database = Database(self.config)
+        self.logger = args[2]
+        self.row_builder = args[3]
 
         self.suburb_task_string = "Storing_results:" + self.suburb_task.name
 
+        # {stage: {table: {'columns': (...), 'values': (...)}}}, made by work()
+        self.result_dict = None
+
+        # What the details come down to, to tell whether they changed since last time (see FingerprintIndex)
+        self.fingerprint = None
+
     def work(self):
-        e, published = self.publish_results(task_result=self.suburb_task.details)
+        self.result_dict = self.row_builder.result_dict(self.suburb_task.details)
 
-        if published:
-            self.logger.debug("Success:" + self.suburb_task_string)
-            return True
+        if self.config.change_detection:
+            self.fingerprint = fingerprint(self.suburb_task.details)
+
+        return True
 
-        else:
-            self.logger.debug("Failed:" + self.suburb_task_string)
-            print(e)
-            return False
-       
-    def publish_results(self, task_result) :
-        """Publishes the data that are related to the transaction id (top level)""" 
-
-        json_result = task_result
-
-        stage, table, column, value = [], [], [], []
-        for key in json_result.keys() :
-
-            split_key = key.split('.')
-
-            if len(split_key) >= 3 :
-                stage.append(split_key[0])
-                table.append(split_key[1])
-                column.append('.'.join(split_key[2:]))
-                value.append(json_result[key])
-
-        # print(f"valus_1: {value}")
-        results = pd.DataFrame({'stage': stage, 'table': table, 'column': column, 'value': value})
-        
-        # make a unique list of the stages we have data to publish
-        stage = list(set(stage))
-        # make an output dictionary to help with formatting to posgres
-        result_dict = {}
-        
-        # go through each stage getting the results in a useful format
-        for s in stage :        
-            result_dict.update({s: {}})     
-            stage_results = results[results['stage'] == s]
-            table_list = list(set(stage_results['table']))
-            for t in table_list : 
-                # subset to a particular table
-                table_results = stage_results[stage_results['table'] == t]
-                # make lists of the columns and corresponding values
-                columns = list(table_results['column'])
-                values = list(table_results['value'])
-                # convert any json elements to appropriate format
-                values = [ psycopg2.extras.Json(v) if isinstance(v, dict) else v for v in values ]
-                # convert any datetime elements 
-                values = [ str(v) if isinstance(v, datetime.datetime) else v for v in values ]
-                # convert floats
-                values = [ float(v) if isinstance(v, np.float32) else v for v in values ]
-                # make sure all the column values are strings
-                columns = [ str(c) for c in columns ]                    
-                # update the output dictionary
-                result_dict[s].update({t:{'columns': columns, 'values': values}})
-
-        error, published = self.database.push_results_to_postgresdb(result_dict, database_conn=self.database_conn)
-
-        return error, published
 
 class StoreStage(Stage):
-    def __init__(self, config, database_conn):
-        Stage.__init__(self, "Store")
+    """ Stores tasks through config.store_writers write-behind writers (one by default).
+
+    A writer thread turns each task it takes into rows (through a StoreMinion) and holds on to them until it has
+    config.store_flush_rows tasks or the oldest one has waited config.store_flush_seconds. Then they are all
+    written in one transaction, with one multi-row INSERT per table, instead of a round trip and a commit per task.
+    Each task still goes to done or error on its own. Every writer writes on its own pooled connection.
+
+    With more than one writer, the tasks are sharded by suburb: a router thread hands each task to the writer of its
+    suburb, so the rows of a suburb are still written in order, and only one writer ever reads and writes its
+    fingerprint.
+
+    With config.change_detection, a task whose details are the same as the last time its suburb was written
+    only gets an "unchanged since" marker (see FingerprintIndex).
+    """
+
+    def __init__(self, config, database_pool):
+        Stage.__init__(self, "Store", queue_size=config.queue_size)
 
         self.config = config
-        self.database_conn = database_conn
+        self.database_pool = database_pool
         logger = self.logger_minion
         self.logger = set_logger(config=self.config, logger=logger)
 
-        self.batch_size = 10
+        # The Database (and its secrets) of the whole process
+        self.database = get_database(self.config)
+
+        # Turns details into rows, with a layout compiled once per set of columns (shared by the writers)
+        self.row_builder = RowBuilder()
+
+        self.flush_rows = self.config.store_flush_rows
+        self.flush_seconds = self.config.store_flush_seconds
+
+        # "insert" (multi-row INSERTs) or "copy" (COPY into staging tables, then merged), see Database
+        if self.config.store_mode == "copy":
+            self.write_group = self.database.copy_result_group
+        else:
+            self.write_group = self.database.push_result_group
+
+        # Fingerprints of what was last written per suburb, loaded when the writers start
+        self.fingerprints = None
+        if self.config.change_detection:
+            self.fingerprints = FingerprintIndex(self.database_pool, self.logger)
+
+        # What was written (or not, being unchanged), and how long the writers spent writing it (for rows/sec)
+        self.rows_written = 0
+        self.tasks_written = 0
+        self.tasks_unchanged = 0
+        self.write_seconds = 0.0
+        self.stats_lock = threading.Lock()
 
     def make_minion(self, task):
-        return StoreMinion(args=(task, self.config, self.database_conn, self.logger))
\ No newline at end of file
+        return StoreMinion(args=(task, self.config, self.logger, self.row_builder))
+
+    def start_workers(self):
+        if self.fingerprints is not None:
+            self.fingerprints.load()
+
+        # Writers instead of a pool of workers, each of them groups its own writes
+        writers = max(1, self.config.store_writers)
+        shards = [self.todo]
+        if writers > 1:
+            shards = [TaskQueue() for _ in range(writers)]
+            router = Thread(target=self.route, args=(shards,), name=f"{self.name}-router", daemon=True)
+            self.workers.append(router)
+            router.start()
+
+        for i, shard in enumerate(shards):
+            worker = Thread(target=self.write_behind, args=(shard,), name=f"{self.name}-writer-{i}", daemon=True)
+            self.workers.append(worker)
+            worker.start()
+
+    def route(self, shards):
+        """ Hand each task of to-do to the writer of its suburb.
+
+        The task stays unfinished in to-do until its writer has reported it back, so the stage is active meanwhile.
+        """
+        while not self.stopping.is_set():
+            try:
+                suburb_task = self.todo.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            shards[zlib.crc32(suburb_task.name.encode("utf-8")) % len(shards)].put(suburb_task)
+
+    def write_behind(self, todo):
+        """ Keep taking tasks from todo (to-do, or this writer's shard of it), and flush them in groups (by size or
+        by time)."""
+        pending = []
+        flush_at = None
+
+        while not self.stopping.is_set():
+
+            # Wait for a task, but not past the time the pending ones have to be written
+            timeout = 0.5 if flush_at is None else max(0.0, flush_at - time.time())
+            try:
+                suburb_task = todo.get(timeout=timeout)
+            except queue.Empty:
+                suburb_task = None
+
+            if suburb_task is not None:
+                minion = self.make_minion(suburb_task)
+                minion.run()
+
+                if minion.success:
+                    pending.append(minion)
+                    if flush_at is None:
+                        flush_at = time.time() + self.flush_seconds
+                else:
+                    # It couldn't even be turned into rows
+                    self.report(minion)
+
+            if pending and (len(pending) >= self.flush_rows or time.time() >= flush_at):
+                self.flush(pending)
+                pending, flush_at = [], None
+
+        if pending:
+            self.flush(pending)
+
+    def flush(self, minions):
+        """ Write the rows of minions in one go (markers for the unchanged ones), then report each of them back."""
+        start_time = time.time()
+
+        changed, unchanged = self.split_unchanged(minions)
+
+        outcomes = []
+        if changed:
+            try:
+                outcomes = self.write_group([minion.result_dict for minion in changed], database_pool=self.database_pool)
+            except Exception as error:
+                outcomes = [(error, None)] * len(changed)
+
+            if self.fingerprints is not None:
+                self.record_fingerprints([minion for minion, (error, published) in zip(changed, outcomes) if published])
+
+        if unchanged:
+            outcomes += self.mark_unchanged(unchanged)
+
+        elapsed = time.time() - start_time
+        with self.stats_lock:
+            self.write_seconds += elapsed
+        self.logger.debug(f"Wrote a group of {len(changed)} tasks (and {len(unchanged)} unchanged) in {elapsed:.3f} seconds")
+
+        for i, (minion, (error, published)) in enumerate(zip(changed + [minion for minion, since in unchanged], outcomes)):
+            if published:
+                self.logger.debug("Success:" + minion.suburb_task_string)
+                with self.stats_lock:
+                    if i < len(changed):
+                        self.tasks_written += 1
+                        self.rows_written += sum(len(tables) for tables in minion.result_dict.values())
+                    else:
+                        self.tasks_unchanged += 1
+
+                # Stored, its details aren't needed any more
+                minion.suburb_task.release()
+
+            else:
+                self.logger.warning("Failed:" + minion.suburb_task_string + f" ({error})")
+                minion.success = False
+
+                # Without an answer from the database at all, it's an error rather than a failure
+                if published is None:
+                    minion.errored = True
+                    minion.suburb_task.error = str(error)
+
+            self.report(minion)
+
+    def split_unchanged(self, minions):
+        """ The minions to write, and [(minion, since_batch_id)] of the ones unchanged since an earlier batch."""
+        if self.fingerprints is None:
+            return minions, []
+
+        changed, unchanged = [], []
+        for minion in minions:
+            since = self.fingerprints.unchanged_since(minion.suburb_task.name, minion.fingerprint)
+            if since is None:
+                changed.append(minion)
+            else:
+                unchanged.append((minion, since))
+
+        return changed, unchanged
+
+    def mark_unchanged(self, unchanged):
+        """ Leave an "unchanged since" marker for each of them. :return: Their outcomes, as write_group's."""
+        markers = [(self.config.scrape_batch_id, minion.suburb_task.name, since) for minion, since in unchanged]
+        try:
+            self.fingerprints.mark_unchanged(markers)
+            return [(None, True)] * len(unchanged)
+
+        except Exception as error:
+            return [(error, None)] * len(unchanged)
+
+    def record_fingerprints(self, minions):
+        fingerprints = [(minion.suburb_task.name, minion.fingerprint, self.config.scrape_batch_id) for minion in minions]
+        if not fingerprints:
+            return
+
+        try:
+            self.fingerprints.record(fingerprints)
+        except Exception as error:
+            # They are written, just not known to be. Next time they are written again
+            self.logger.warning(f"Could not record the fingerprints of {len(fingerprints)} tasks ({error})")
+
+    def summary(self):
+        rows_per_second = self.rows_written / self.write_seconds if self.write_seconds > 0 else 0.0
+        summary = f"({self.config.store_mode}) wrote {self.rows_written} rows in {self.write_seconds:.1f} seconds, " \
+                  f"{rows_per_second:.1f} rows/sec"
+
+        if self.fingerprints is not None:
+            summary += f", {self.tasks_written} tasks written, {self.tasks_unchanged} skipped as unchanged"
+
+        summary += f"; statement cache: {self.database.statement_cache.summary()}"
+
+        return summary
+
+    def report(self, minion):
+        self.results.put(minion)
+        self.notify()
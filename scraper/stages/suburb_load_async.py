@@ -0,0 +1,88 @@
+import asyncio
+import queue
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+
+from scraper.stages.suburb_load import SuburbLoadStage, SuburbLoadMinion
+from scraper.http_client import get_http_client
+
+
+class SuburbLoadAsyncStage(SuburbLoadStage):
+    """ Loads suburbs like SuburbLoadStage, but fetches the pages on a single asyncio event loop.
+
+    Up to config.async_concurrency requests are kept in flight at once, through the shared http client.
+    Each fetched page is handed to a SuburbLoadMinion (on a small thread pool, parsing holds the GIL anyway),
+    so the parsing, tagging and error handling are exactly those of the threaded stage.
+    """
+
+    def __init__(self, config):
+        SuburbLoadStage.__init__(self, config)
+
+        self.name = "suburb_load_async"
+        self.concurrency = self.config.async_concurrency
+        self.http_client = get_http_client(self.config)
+
+    def start_workers(self):
+        # One thread runs the event loop instead of a pool of fetching workers
+        worker = Thread(target=self.run_event_loop, name=f"{self.name}-loop", daemon=True)
+        self.workers.append(worker)
+        worker.start()
+
+    def run_event_loop(self):
+        asyncio.run(self.load_all())
+
+    async def load_all(self):
+        """ Keep taking tasks from to-do and loading them, never more than self.concurrency at a time."""
+        loop = asyncio.get_running_loop()
+        limit = asyncio.Semaphore(self.concurrency)
+        in_flight = set()
+
+        with ThreadPoolExecutor(max_workers=self.batch_size, thread_name_prefix=self.name) as parsers:
+            async with self.http_client.async_session(self.concurrency) as session:
+
+                while not self.stopping.is_set():
+                    await limit.acquire()
+
+                    try:
+                        # Wait for work off the loop (like a StageWorker, waking up now and then to see if we stop)
+                        suburb_task = await loop.run_in_executor(None, self.todo.get, True, 0.5)
+                    except queue.Empty:
+                        limit.release()
+                        continue
+
+                    load = asyncio.create_task(self.load(loop, session, parsers, suburb_task, limit))
+                    in_flight.add(load)
+                    load.add_done_callback(in_flight.discard)
+
+                # Let whatever is still loading finish
+                if in_flight:
+                    await asyncio.gather(*in_flight, return_exceptions=True)
+
+    async def load(self, loop, session, parsers, suburb_task, limit):
+        """ Fetch one suburb page, then parse and tag it through a minion."""
+        try:
+
+            try:
+                url = suburb_task.urls["suburb_main_url"]
+                source = await self.fetch(session, url)
+            except Exception as error:
+                # The minion raises it, so it ends up on the task like any other error
+                source = error
+
+            minion = SuburbLoadMinion(args=(suburb_task, self.config, self.logger, self.field_mapping),
+                                      kwargs={"source": source})
+
+            # Parsing and reporting back may block, keep them off the event loop
+            await loop.run_in_executor(parsers, self.finish, minion)
+
+        finally:
+            limit.release()
+
+    async def fetch(self, session, url):
+        return await self.http_client.get_text_async(session, url)
+
+    def finish(self, minion):
+        minion.run()
+
+        self.results.put(minion)
+        self.notify()
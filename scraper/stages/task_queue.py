@@ -0,0 +1,74 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import queue
+
+
+class TaskQueue(queue.Queue):
+    """ A thread-safe FIFO of Tasks sitting between (or inside) stages.
+
+    It is a plain queue.Queue (deque underneath, so O(1) at both ends), with a few conveniences so the
+    pipeline can still count, show and move tasks around the way it did with lists.
+    A maxsize of 0 (or None) means the queue is unbounded.
+    """
+
+    def __init__(self, maxsize=0):
+        super().__init__(maxsize=maxsize or 0)
+
+    def __len__(self):
+        return self.qsize()
+
+    def __iter__(self):
+        """ Iterate over a snapshot of the queued tasks (the queue itself is left alone). """
+
+        with self.mutex:
+            snapshot = list(self.queue)
+
+        return iter(snapshot)
+
+    def in_hand(self):
+        """ How many tasks were taken out (get()) and not given back yet (task_done()).
+
+        A task is counted from the moment it is put in until task_done(), in the queue or in hand, so nothing can
+        be in between where it would go uncounted.
+        """
+
+        with self.mutex:
+            return self.unfinished_tasks - len(self.queue)
+
+    def unfinished(self):
+        """ How many tasks are queued or in hand (see in_hand)."""
+
+        with self.mutex:
+            return self.unfinished_tasks
+
+    def free_slots(self):
+        """ How many more tasks fit before a put() would block. None if unbounded. """
+
+        if self.maxsize <= 0:
+            return None
+
+        return max(0, self.maxsize - self.qsize())
+
+    def extend(self, tasks):
+        """ Put all the tasks in, blocking if the queue is bounded and full. """
+
+        for task in tasks:
+            self.put(task)
+
+    def drain(self, limit=None):
+        """ Take up to limit (or all) tasks out without blocking.
+
+        :param limit: The maximum number of tasks to take, None for all of them.
+        :return: A list of tasks in FIFO order.
+        """
+
+        tasks = []
+
+        while limit is None or len(tasks) < limit:
+            try:
+                tasks.append(self.get_nowait())
+            except queue.Empty:
+                break
+
+        return tasks
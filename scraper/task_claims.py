@@ -0,0 +1,303 @@
+#  Copyright (C) 2021
+#  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
+
+import time
+import threading
+from threading import Thread
+
+import psycopg2.extras
+
+from utils.suburb_task import SuburbTask
+
+
+# The chunk is picked in a CTE, which runs once. As a subquery of the UPDATE it can be rescanned, and with
+# SKIP LOCKED every rescan picks a fresh chunk (one worker would end up claiming far more than its LIMIT)
+CLAIM_QUERY = """
+WITH chunk AS (
+    SELECT suburb_name FROM scrape_batch_task
+    WHERE scrape_batch_id = %s AND attempts < %s
+      AND (status = 'todo' OR (status = 'claimed' AND lease_until < now()))
+    ORDER BY suburb_name
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED)
+UPDATE scrape_batch_task t
+SET status = 'claimed', claimed_by = %s, lease_until = now() + %s * interval '1 second',
+    attempts = t.attempts + 1, updated_at = now()
+FROM chunk
+WHERE t.scrape_batch_id = %s AND t.suburb_name = chunk.suburb_name
+RETURNING t.suburb_name, t.suburb_urls, t.attempts;
+"""
+
+HEARTBEAT_QUERY = """
+UPDATE scrape_batch_task SET lease_until = now() + %s * interval '1 second', updated_at = now()
+WHERE scrape_batch_id = %s AND suburb_name = ANY(%s) AND claimed_by = %s AND status = 'claimed';
+"""
+
+# Tasks whose every attempt ran out of lease (the worker died on them each time) are given up on
+GIVE_UP_QUERY = """
+UPDATE scrape_batch_task SET status = 'error', error = 'Lease expired on every attempt (' || attempts || ')',
+    lease_until = NULL, updated_at = now()
+WHERE scrape_batch_id = %s AND status = 'claimed' AND lease_until < now() AND attempts >= %s;
+"""
+
+# Only the tasks this worker still holds: once its lease ran out, a task is another worker's to finish
+FINISH_QUERY = """
+UPDATE scrape_batch_task t SET status = v.status, error = v.error, lease_until = NULL, updated_at = now()
+FROM (VALUES %s) AS v(scrape_batch_id, suburb_name, status, error, claimed_by)
+WHERE t.scrape_batch_id = v.scrape_batch_id AND t.suburb_name = v.suburb_name
+    AND t.claimed_by = v.claimed_by AND t.status = 'claimed'
+RETURNING t.suburb_name;
+"""
+
+REMAINING_QUERY = """
+SELECT count(*) FROM scrape_batch_task WHERE scrape_batch_id = %s AND status IN ('todo', 'claimed');
+"""
+
+
+def publish_tasks(config, database_pool):
+    """ Put the run's suburbs in scrape_batch_task, for the workers of the scrape_batch_id to claim.
+
+    Suburbs already there are left as they are, so publishing twice is harmless.
+
+    :return: The number of suburbs newly published.
+    """
+    rows = [(config.scrape_batch_id, name, psycopg2.extras.Json(urls)) for name, urls in config.suburb_base_urls.items()]
+
+    with database_pool.connection() as database_conn:
+        cursor = database_conn.cursor()
+        try:
+            published = psycopg2.extras.execute_values(
+                cursor,
+                "INSERT INTO scrape_batch_task(scrape_batch_id, suburb_name, suburb_urls) VALUES %s "
+                "ON CONFLICT (scrape_batch_id, suburb_name) DO NOTHING RETURNING suburb_name;",
+                rows, page_size=1000, fetch=True)
+            return len(published)
+
+        finally:
+            cursor.close()
+
+
+def claim_progress(database_pool, scrape_batch_id):
+    """ Where a distributed batch is at, from the scrape_batch_progress view (None if nothing was published)."""
+    with database_pool.connection() as database_conn:
+        cursor = database_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            cursor.execute("SELECT * FROM scrape_batch_progress WHERE scrape_batch_id = %s;", (scrape_batch_id,))
+            return cursor.fetchone()
+
+        finally:
+            cursor.close()
+
+
+class TaskClaims(Thread):
+    """ Feeds a pipeline with suburbs claimed from scrape_batch_task, so several workers can share one batch.
+
+    Tasks are claimed a chunk at a time (FOR UPDATE SKIP LOCKED, so workers never claim the same ones) whenever
+    the first stage runs short, under a lease that is renewed every lease_seconds / 3 while we hold them. A worker
+    that dies stops renewing, and its tasks are claimed again by the others once the lease runs out. Finished
+    tasks are marked done or error (see finished()). The pipeline keeps going until no task of the batch is left,
+    so tasks that are reclaimed late still have someone to run them.
+    """
+
+    def __init__(self, config, database_pool, logger, todo, on_change, poll_seconds=1.0):
+        """
+        :param config: The batch (scrape_batch_id), who we are (name) and the claim settings.
+        :param database_pool: Where scrape_batch_task is.
+        :param logger: Where claiming problems are reported (it is tried again next time around).
+        :param todo: The to-do queue of the first stage, claimed tasks go there.
+        :param on_change: Called when tasks were added or the batch moved on (wakes the pipeline up).
+        :param poll_seconds: Seconds between two looks at the batch.
+        """
+        super().__init__(name="task-claims", daemon=True)
+
+        self.config = config
+        self.scrape_batch_id = config.scrape_batch_id
+        self.database_pool = database_pool
+        self.logger = logger
+        self.todo = todo
+        self.on_change = on_change
+        self.poll_seconds = poll_seconds
+
+        self.chunk = config.claim_chunk
+        self.lease_seconds = config.claim_lease_seconds
+        self.max_attempts = config.claim_attempts
+
+        # The names of the tasks we claimed and haven't finished yet (their leases are ours to renew)
+        self.held = set()
+        # [(name, status, error)] finished, still to be marked in the table
+        self.finishing = []
+        self.lock = threading.Lock()
+
+        # Tasks of the batch not done or in error yet, across all workers (None until we have looked)
+        self.remaining = None
+        self.claimed = 0
+        self.next_heartbeat = 0.0
+
+        self.stopping = threading.Event()
+        # Set when the first stage runs short, so we claim straight away rather than at the next poll
+        self.wanted = threading.Event()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                self.step()
+            except Exception as e:
+                self.logger.warning(f"Could not claim or report tasks ({e}), trying again")
+
+            self.wanted.wait(self.poll_seconds)
+            self.wanted.clear()
+
+        # Whatever finished last still gets marked
+        try:
+            self.mark_finished()
+        except Exception as e:
+            self.logger.warning(f"Could not mark the last tasks finished ({e}), their leases will run out")
+
+    def step(self):
+        """ Mark what finished, renew our leases, top the first stage up, and see what is left of the batch."""
+        self.mark_finished()
+
+        if time.time() >= self.next_heartbeat:
+            self.heartbeat()
+            self.next_heartbeat = time.time() + self.lease_seconds / 3
+
+        added = 0
+        if len(self.todo) < self.chunk:
+            added = self.claim()
+
+        remaining = self.count_remaining()
+        changed = added > 0 or remaining != self.remaining
+        self.remaining = remaining
+
+        if changed:
+            self.on_change()
+
+    def claim(self):
+        """ Claim up to a chunk of tasks (new ones, or ones whose lease ran out) into the first stage."""
+        worker = self.config.name
+
+        with self.database_pool.connection() as database_conn:
+            cursor = database_conn.cursor()
+            try:
+                cursor.execute(GIVE_UP_QUERY, (self.scrape_batch_id, self.max_attempts))
+                if cursor.rowcount:
+                    self.logger.warning(f"Gave up on {cursor.rowcount} tasks that ran out of lease {self.max_attempts} times")
+
+                cursor.execute(CLAIM_QUERY, (self.scrape_batch_id, self.max_attempts, self.chunk,
+                                             worker, self.lease_seconds, self.scrape_batch_id))
+                rows = cursor.fetchall()
+
+            finally:
+                cursor.close()
+
+        tasks = []
+        for name, urls, attempts in rows:
+            suburb_task = SuburbTask(name)
+            suburb_task.urls = urls
+            tasks.append(suburb_task)
+
+            if attempts > 1:
+                self.logger.info(f"Reclaimed {name} (attempt {attempts})")
+
+        with self.lock:
+            self.held.update(suburb_task.name for suburb_task in tasks)
+        self.claimed += len(tasks)
+
+        self.todo.extend(tasks)
+        if tasks:
+            self.logger.debug(f"Claimed {len(tasks)} tasks of scrape_batch_id {self.scrape_batch_id}")
+
+        return len(tasks)
+
+    def heartbeat(self):
+        """ Push the leases of the tasks we hold further out."""
+        with self.lock:
+            held = list(self.held)
+
+        if not held:
+            return
+
+        with self.database_pool.connection() as database_conn:
+            cursor = database_conn.cursor()
+            try:
+                cursor.execute(HEARTBEAT_QUERY, (self.lease_seconds, self.scrape_batch_id, held, self.config.name))
+
+                # Fewer means some lease ran out before we renewed it, and another worker may run those too
+                if cursor.rowcount < len(held):
+                    self.logger.warning(f"Lost the lease of {len(held) - cursor.rowcount} of {len(held)} tasks")
+
+            finally:
+                cursor.close()
+
+    def finished(self, tasks, status):
+        """ Tasks that came out of the pipeline, as "done" or "error". Called by the pipeline, marked by our thread."""
+        with self.lock:
+            for suburb_task in tasks:
+                error = None if suburb_task.error is None else str(suburb_task.error)
+                self.finishing.append((suburb_task.name, status, error))
+
+    def mark_finished(self):
+        with self.lock:
+            finishing, self.finishing = self.finishing, []
+
+        if not finishing:
+            return
+
+        worker = self.config.name
+        rows = [(self.scrape_batch_id, name, status, error, worker) for name, status, error in finishing]
+        try:
+            with self.database_pool.connection() as database_conn:
+                cursor = database_conn.cursor()
+                try:
+                    marked = psycopg2.extras.execute_values(cursor, FINISH_QUERY, rows, page_size=1000, fetch=True)
+                finally:
+                    cursor.close()
+
+        except Exception:
+            # Keep them for next time, we hold on to their leases until then
+            with self.lock:
+                self.finishing = finishing + self.finishing
+            raise
+
+        # The others ran out of lease and were claimed again, what we found is left to whoever holds them now
+        if len(marked) < len(rows):
+            self.logger.warning(f"{len(rows) - len(marked)} of {len(rows)} finished tasks were no longer ours "
+                                f"(their lease ran out), left them to the worker that holds them")
+
+        with self.lock:
+            self.held.difference_update(name for name, status, error in finishing)
+
+    def count_remaining(self):
+        with self.database_pool.connection() as database_conn:
+            cursor = database_conn.cursor()
+            try:
+                cursor.execute(REMAINING_QUERY, (self.scrape_batch_id,))
+                return cursor.fetchone()[0]
+
+            finally:
+                cursor.close()
+
+    def want_more(self):
+        """ Called by the pipeline as it goes around: wakes us up if the first stage is running short."""
+        if len(self.todo) < self.chunk:
+            self.wanted.set()
+
+    def has_more(self):
+        """ True while the batch has tasks that are not done or in error (ours or another worker's)."""
+        with self.lock:
+            if self.finishing:
+                return True
+
+        return self.remaining is None or self.remaining > 0
+
+    def status(self):
+        remaining = "?" if self.remaining is None else self.remaining
+        with self.lock:
+            held = len(self.held)
+        return f"{self.claimed} claimed, {held} held, {remaining} left"
+
+    def stop(self):
+        self.stopping.set()
+        self.wanted.set()
+        if self.is_alive():
+            self.join()
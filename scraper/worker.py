@@ -1,26 +1,34 @@
 #  Copyright (C) 2021
 #  Author: Zubair Ahmed <zub41r.ahm3d@gmail.com>
 
+import copy
+import queue
+import logging
+import multiprocessing
+
 from scraper.pipeline import Pipeline
+from scraper.database import get_database
+from scraper.rate_limiter import make_shared_rate_limit, share_rate_limit
+from utils.helper_functions import set_logger, peak_rss_mb
+from utils.logging_config import setup_logging, process_log_queue, stop_logging
+
+# Worker processes start fresh (no threads, locks or connections inherited half way through something)
+CONTEXT = multiprocessing.get_context("spawn")
 
 
-# TODO: class Worker(multiprocessing.Process):
 class Worker:
     """A worker runs a pipeline of processing stages as a process."""
 
-    def __init__(self, logger, config, database_conn):
+    def __init__(self, logger, config, database_pool):
         """Every time a worker is initiated, there are a few items to setup."""
 
         # Keep a copy of the configuration
         self.logger = logger
         self.config = config
-        self.database_conn = database_conn
+        self.database_pool = database_pool
 
         # Pass the worker configuration through to the pipeline
-        self.pipeline = Pipeline(logger=self.logger, config=self.config, database_conn=self.database_conn)
-
-        # TODO: Run multiprocessing setup as per parent.
-        # multiprocessing.Process.__init__(self)
+        self.pipeline = Pipeline(logger=self.logger, config=self.config, database_pool=self.database_pool)
 
     def run(self):
         """Run method overrides Process.run() and lets the worker work."""
@@ -30,3 +38,125 @@ class Worker:
 
         # Run the pipeline
         self.pipeline.run()
+
+    def summary(self):
+        """What the pipeline did: the suburbs done, the ones in error (with the end of their error) and the peak RSS."""
+        return {"done": [task.name for task in self.pipeline.done_stage.todo],
+                "errors": [(task.name, task.error) for task in self.pipeline.error_stage.todo],
+                "peak_rss_mb": peak_rss_mb()}
+
+
+class WorkerProcess(CONTEXT.Process):
+    """A Worker in a process of its own, running a shard of the suburbs.
+
+    It has its own database connections, logs through the main process and takes its request tokens from the
+    run's shared rate limit. What it did goes back on the results queue (see Worker.summary).
+    """
+
+    def __init__(self, config, log_queue, shared_rate_limit, results):
+        super().__init__(name=config.name)
+
+        self.config = config
+        self.log_queue = log_queue
+        self.shared_rate_limit = shared_rate_limit
+        self.results = results
+
+    def run(self):
+        setup_logging(self.config, log_queue=self.log_queue)
+        share_rate_limit(self.shared_rate_limit)
+
+        logger = set_logger(self.config, logging.getLogger(self.name))
+        logger.debug(f"Worker process starts with {len(self.config.suburb_base_urls)} suburbs")
+
+        database_pool = get_database(self.config).connect_db()
+        try:
+            worker = Worker(logger, self.config, database_pool)
+            worker.run()
+            log_fetch_summary(logger, self.config)
+
+            self.results.put((self.name, worker.summary()))
+
+        finally:
+            database_pool.close()
+            stop_logging()
+
+
+def log_fetch_summary(logger, config):
+    """Log what the http cache and the raw page archive of this process did."""
+    from scraper.http_client import get_http_client
+    from scraper.page_archive import get_page_archive
+
+    http_cache = get_http_client(config).cache
+    if http_cache is not None:
+        logger.info(f"HTTP cache {http_cache.summary()}")
+
+    logger.info(f"Raw page archive {get_page_archive(config).summary()}")
+
+
+def run_workers(logger, config, workers):
+    """Run the suburbs through a number of worker processes, a shard each, under the same scrape_batch_id.
+
+    Distributed, there are no shards: every process claims its tasks from the batch like any other worker.
+
+    :param logger: Where the run summary goes.
+    :param config: The run's config (with the suburbs and scrape_batch_id).
+    :param workers: The number of worker processes.
+    :return: What the workers did together, as Worker.summary() does.
+    """
+    names = sorted(config.suburb_base_urls)
+    if config.distributed:
+        shards = [names] * workers
+    else:
+        shards = [names[i::workers] for i in range(workers)]
+
+    log_queue = process_log_queue(CONTEXT)
+    shared_rate_limit = make_shared_rate_limit(CONTEXT, config)
+    results = CONTEXT.Queue()
+
+    processes = []
+    for i, shard in enumerate(shards):
+        shard_config = copy.copy(config)
+        shard_config.name = f"{config.name}-{i}"
+        if not config.distributed:
+            shard_config.suburb_base_urls = {name: config.suburb_base_urls[name] for name in shard}
+
+        process = WorkerProcess(shard_config, log_queue, shared_rate_limit, results)
+        process.start()
+        processes.append(process)
+
+    # Gather before joining (a process can't exit with its result still in the queue)
+    summaries = {}
+    while len(summaries) < len(processes):
+        try:
+            name, summary = results.get(timeout=1)
+            summaries[name] = summary
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes) and results.empty():
+                break
+
+    for process in processes:
+        process.join()
+
+        if process.name not in summaries:
+            logger.error(f"Worker process {process.name} died (exit code {process.exitcode}), its suburbs are not done")
+
+    run_summary = {"done": [], "errors": [], "peak_rss_mb": None}
+    for summary in summaries.values():
+        run_summary["done"] += summary["done"]
+        run_summary["errors"] += summary["errors"]
+
+        # The biggest of the worker processes
+        if summary["peak_rss_mb"] is not None:
+            run_summary["peak_rss_mb"] = max(run_summary["peak_rss_mb"] or 0.0, summary["peak_rss_mb"])
+
+    # Distributed, what a dead process held is claimed again once its leases run out
+    unaccounted = 0 if config.distributed else len(names) - len(run_summary['done']) - len(run_summary['errors'])
+    peak = "?" if run_summary["peak_rss_mb"] is None else f"{run_summary['peak_rss_mb']:.1f}"
+    logger.info(f"{len(processes)} worker processes, scrape_batch_id {config.scrape_batch_id}: "
+                f"{len(run_summary['done'])} done, {len(run_summary['errors'])} in error, "
+                f"{unaccounted} unaccounted for, peak RSS {peak} MB per worker")
+
+    for name, error in run_summary["errors"][:10]:
+        logger.debug(f"Error in: {name!r} with {error!r}")
+
+    return run_summary
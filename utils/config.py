@@ -29,9 +29,30 @@ class AppConfig:
         self.suburb_path = os.path.join(self.suburb_dir, "suburb_" + self.timestr)
         self.create_dir(self.suburb_dir)
         
+        # Downloaded pages are kept here (and revalidated) between runs
+        self.use_http_cache = (os.environ.get("USE_HTTP_CACHE", "true") == 'true')
+        self.http_cache_dir = os.environ.get("HTTP_CACHE_DIR", "resources/http_cache")
+        self.http_cache_max_mb = float(os.environ.get("HTTP_CACHE_MAX_MB", "500"))
+        self.http_cache_max_age_days = float(os.environ.get("HTTP_CACHE_MAX_AGE_DAYS", "30"))
+        self.create_dir(self.http_cache_dir)
+
+        # Raw pages are archived here, once per distinct page
+        self.raw_page_dir = os.environ.get("RAW_PAGE_DIR", "resources/raw_pages")
+        self.create_dir(self.raw_page_dir)
+
         self.log_dir = os.environ["LOG_DIR"]
         self.log_path = os.path.join(self.log_dir, "log_" + self.timestr +".log")
         self.create_dir(self.log_dir)
+
+        # Log levels: the default one, and per logger (eg. per stage) as "suburb_load=INFO,Store=DEBUG"
+        self.log_level = os.environ.get("LOG_LEVEL", "DEBUG")
+        self.log_levels = os.environ.get("LOG_LEVELS", "")
+        # Debug lines (mostly one per task) are thinned out: keep one in LOG_DEBUG_SAMPLE, at most LOG_DEBUG_PER_SECOND a second (0: no limit)
+        self.log_debug_sample = int(os.environ.get("LOG_DEBUG_SAMPLE", "1"))
+        self.log_debug_per_second = int(os.environ.get("LOG_DEBUG_PER_SECOND", "200"))
+        # The log is shipped to the database every LOG_UPLOAD_SECONDS, in gzipped chunks of up to LOG_CHUNK_KB of log
+        self.log_upload_seconds = float(os.environ.get("LOG_UPLOAD_SECONDS", "60"))
+        self.log_chunk_kb = float(os.environ.get("LOG_CHUNK_KB", "1024"))
         
         self.suburb_main_dict: dict = {}
         self.suburb_base_urls: dict = {}
@@ -39,6 +60,61 @@ class AppConfig:
         stage_list = os.environ["STAGE_LIST"]
         self.stage_list = [stage for stage in stage_list.split(',')]
 
+        # The most tasks allowed to queue up between two stages before the upstream stage waits
+        self.queue_size = int(os.environ.get("QUEUE_SIZE", "50"))
+
+        # How suburb pages are loaded: "threaded" (a pool of workers) or "async" (one event loop)
+        self.suburb_load_mode = os.environ.get("SUBURB_LOAD_MODE", "threaded")
+        # The most requests the async loader keeps in flight
+        self.async_concurrency = int(os.environ.get("ASYNC_CONCURRENCY", "100"))
+
+        # Requests per second allowed to each host (shared by the whole process), and how many may go at once
+        self.requests_per_second = float(os.environ.get("REQUESTS_PER_SECOND", "1.5"))
+        self.request_burst = int(os.environ.get("REQUEST_BURST", "2"))
+
+        # How pages are parsed: "fast" (lxml + XPath) or "soup" (BeautifulSoup), both give the same results
+        self.html_parser = os.environ.get("HTML_PARSER", "fast")
+
+        # Http connect/read timeouts (seconds), and how often (with what base back off) a failed request is retried
+        self.http_connect_timeout = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+        self.http_read_timeout = float(os.environ.get("HTTP_READ_TIMEOUT", "30"))
+        self.http_retries = int(os.environ.get("HTTP_RETRIES", "3"))
+        self.http_backoff = float(os.environ.get("HTTP_BACKOFF", "1"))
+
+        # Store writers (each writes on its own database connection, the pool is sized after them). One keeps every
+        # write in order, with more each suburb is always written by the same one (see StoreStage)
+        self.store_writers = int(os.environ.get("STORE_WRITERS", "1"))
+        # The store stage writes tasks in groups: when it has this many, or the oldest has waited this long (seconds)
+        self.store_flush_rows = int(os.environ.get("STORE_FLUSH_ROWS", "100"))
+        self.store_flush_seconds = float(os.environ.get("STORE_FLUSH_SECONDS", "2"))
+        # How the groups are written: "insert" (multi-row INSERTs) or "copy" (COPY through staging tables, for bulk loads)
+        self.store_mode = os.environ.get("STORE_MODE", "insert")
+
+        # Finished tasks are journaled here (per batch and worker) for run --resume, and fsync-ed every
+        # JOURNAL_SYNC_TASKS tasks or JOURNAL_SYNC_SECONDS seconds
+        self.journal_dir = os.environ.get("JOURNAL_DIR", "resources/journal")
+        self.journal_sync_tasks = int(os.environ.get("JOURNAL_SYNC_TASKS", "50"))
+        self.journal_sync_seconds = float(os.environ.get("JOURNAL_SYNC_SECONDS", "1"))
+        self.create_dir(self.journal_dir)
+
+        # Distributed runs: several workers (containers) share one batch through scrape_batch_task (see TaskClaims).
+        # Tasks are claimed CLAIM_CHUNK at a time under a lease of CLAIM_LEASE_SECONDS (renewed while held), and
+        # given up on after CLAIM_ATTEMPTS leases ran out on them
+        self.distributed = (os.environ.get("DISTRIBUTED", "false") == 'true')
+        self.claim_chunk = int(os.environ.get("CLAIM_CHUNK", "10"))
+        self.claim_lease_seconds = float(os.environ.get("CLAIM_LEASE_SECONDS", "120"))
+        self.claim_attempts = int(os.environ.get("CLAIM_ATTEMPTS", "3"))
+
+        # Statements written one result at a time are PREPAREd once per connection and EXECUTEd after that. Off by
+        # default: prepared statements live on a server connection, which a pooler in transaction mode (eg. pgbouncer)
+        # doesn't keep for us, and they fail once the tables they were prepared on change
+        self.prepare_statements = (os.environ.get("PREPARE_STATEMENTS", "false") == 'true')
+
+        # Suburbs whose details are the same as the last time they were written only get an "unchanged since" marker
+        # (in suburb_unchanged) instead of new suburb_stats rows. Off by default: with it on, a batch's suburb_stats
+        # only has the suburbs that changed, so whatever reads a batch has to read suburb_unchanged as well
+        self.change_detection = (os.environ.get("CHANGE_DETECTION", "false") == 'true')
+
         # Placeholder for the raw scrape pages
         self.raw_scrape_suburb_list = None
 
@@ -3,6 +3,15 @@ import pickle
 import shutil
 import logging
 import glob
+import sys
+
+# Not on Windows, there is no peak RSS to tell there
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from utils.logging_config import setup_logging, logger_level
 
 # we need these to check if an image is broken and try to fix
 # from PIL import Image
@@ -144,20 +153,20 @@ def create_dir(dir_path):
     if not os.path.exists(dir_path):
         os.makedirs(dir_path)
 
+def peak_rss_mb():
+    """ The most memory (resident set size, in MB) this process has held so far, None where it can't be told."""
+    if resource is None:
+        return None
+
+    # Linux counts in KB, macOS in bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
 def set_logger(config, logger):
     # argument logger has been initiated already with respective module
-    logger.setLevel(logging.DEBUG)
-    
-    formatter = logging.Formatter('%(asctime)s: [%(levelname)s] [%(name)s] (%(threadName)-10s) %(message)s')
-    
-    file_handler = logging.FileHandler(config.log_path)
-    file_handler.setFormatter(formatter)
-    
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(formatter)
-    
-    logger.addHandler(stream_handler)
-    logger.addHandler(file_handler)
+    # Loggers don't get handlers of their own, they all go through the one (queued) setup
+    setup_logging(config)
+    logger.setLevel(logger_level(logger.name))
 
     return logger
 
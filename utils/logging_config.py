@@ -0,0 +1,185 @@
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+FORMAT = '%(asctime)s: [%(levelname)s] [%(name)s] (%(threadName)-10s) %(message)s'
+
+
+class DebugSampler(logging.Filter):
+    """ Keeps every sample-th DEBUG line, and at most per_second of them a second. Other levels always go through.
+
+    Most DEBUG lines are per task (Work/Success/Failed ...), on a big run these are the ones to thin out.
+    """
+
+    def __init__(self, sample=1, per_second=0):
+        """
+        :param sample: Keep one DEBUG line in this many (1 keeps them all).
+        :param per_second: The most DEBUG lines kept in a second (0 for no limit).
+        """
+        super().__init__()
+
+        self.sample = max(1, sample)
+        self.per_second = per_second
+
+        self.seen = 0
+        self.dropped = 0
+        self.second = None
+        self.kept_this_second = 0
+
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+
+        with self.lock:
+            self.seen += 1
+            if self.seen % self.sample:
+                self.dropped += 1
+                return False
+
+            if self.per_second:
+                second = int(time.monotonic())
+                if second != self.second:
+                    self.second, self.kept_this_second = second, 0
+
+                if self.kept_this_second >= self.per_second:
+                    self.dropped += 1
+                    return False
+
+                self.kept_this_second += 1
+
+        return True
+
+
+def parse_level(level, setting):
+    """ "warning" -> logging.WARNING. A name logging doesn't know is warned about and taken as INFO, so a typo in
+    the config doesn't stop the app at startup (setLevel raises on it).
+
+    :param setting: Where the name comes from, for the warning.
+    """
+    value = logging.getLevelName(level.strip().upper())
+    if isinstance(value, int):
+        return value
+
+    logging.getLogger(__name__).warning(f"Unknown log level {level!r} in {setting}, using INFO")
+    return logging.INFO
+
+
+def parse_levels(log_levels):
+    """ "suburb_load=INFO,Store=WARNING" -> {"suburb_load": logging.INFO, "Store": logging.WARNING}"""
+    levels = {}
+    for item in log_levels.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = parse_level(level, f"LOG_LEVELS ({name.strip()})")
+    return levels
+
+
+_listener = None
+_process_listener = None
+_queue_handler = None
+_sampler = None
+_default_level = logging.DEBUG
+_levels = {}
+_logging_lock = threading.Lock()
+
+
+def setup_logging(config, log_queue=None):
+    """ Send every log line through a queue to a single listener thread, which does the file and console writing.
+
+    Threads that log only put the line on an (unbounded) queue, so they never wait on the disk. Only the first call
+    sets anything up, calling it again is fine.
+
+    :param config: The log file and levels.
+    :param log_queue: For worker processes: log to this queue (see process_log_queue) instead of writing ourselves.
+    """
+    global _listener, _queue_handler, _sampler, _default_level, _levels
+
+    with _logging_lock:
+        if _queue_handler is not None:
+            return
+
+        if log_queue is None:
+            formatter = logging.Formatter(FORMAT)
+
+            file_handler = logging.FileHandler(config.log_path)
+            file_handler.setFormatter(formatter)
+
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(formatter)
+
+            log_queue = queue.Queue()
+            _listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+
+        _sampler = DebugSampler(config.log_debug_sample, config.log_debug_per_second)
+        _queue_handler = logging.handlers.QueueHandler(log_queue)
+        _queue_handler.addFilter(_sampler)
+
+        # Our loggers all propagate up to here, each with its own level (see logger_level)
+        logging.getLogger().addHandler(_queue_handler)
+
+        _default_level = parse_level(config.log_level, "LOG_LEVEL")
+        _levels = parse_levels(config.log_levels)
+
+        if _listener is not None:
+            _listener.start()
+
+        atexit.register(stop_logging)
+
+
+def process_log_queue(context):
+    """ A queue that worker processes log to (setup_logging(config, log_queue)), written out by this process.
+
+    :param context: The multiprocessing context the worker processes are started with.
+    """
+    global _process_listener
+
+    with _logging_lock:
+        if _process_listener is None:
+            _process_listener = logging.handlers.QueueListener(context.JoinableQueue(), *_listener.handlers)
+            _process_listener.start()
+
+        return _process_listener.queue
+
+
+def logger_level(name):
+    """ The level configured for the logger called name (LOG_LEVELS), or the default one (LOG_LEVEL)."""
+    return _levels.get(name, _default_level)
+
+
+def flush_logging():
+    """ Wait until every line logged so far has been written."""
+    for listener in (_listener, _process_listener):
+        if listener is not None:
+            listener.queue.join()
+
+
+def stop_logging():
+    """ Write out whatever is still queued and stop the listener(s)."""
+    global _listener, _process_listener, _queue_handler
+
+    with _logging_lock:
+        if _queue_handler is None:
+            return
+
+        if _sampler.dropped:
+            logger = logging.getLogger(__name__)
+            logger.setLevel(logger_level(__name__))
+            logger.info(f"Sampling left out {_sampler.dropped} of {_sampler.seen} debug lines")
+
+        if _process_listener is not None:
+            _process_listener.stop()
+            _process_listener = None
+
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
@@ -14,6 +14,39 @@ class SuburbTask:
     def tag_details(self, tag, value):
         self.details[tag] = value
 
+    def release(self):
+        """ Drop the details once they are stored, the task keeps only what says which suburb it was."""
+        self.details = {}
+
+
+# How much of an error (the end of it, where the exception is) a summary keeps
+SUMMARY_ERROR_CHARS = 300
+
+
+def short_error(error):
+    return None if error is None else str(error)[-SUMMARY_ERROR_CHARS:]
+
+
+class TaskSummary:
+    """ What is left of a task once it is through the pipeline: its name, how it went and (the end of) its error."""
+
+    __slots__ = ("name", "status", "error")
+
+    def __init__(self, name, status, error=None):
+        self.name = name
+        self.status = status
+        self.error = error
+
+    @classmethod
+    def of(cls, suburb_task, status):
+        return cls(suburb_task.name, status, short_error(suburb_task.error))
+
+    def __str__(self):
+        return str(self.name)
+
+    def __repr__(self):
+        return f"TaskSummary({self.name!r}, {self.status!r})"
+
 
 class SuburbPropertyTask(SuburbTask):
     def __init__(self, property_name):